@@ -1,5 +1,37 @@
 from django.contrib import admin
-from .models import RawCsv,Key
+from .models import RawCsv,Key,MarketData,PriceSnapshot,AnalysisJob,AnalysisResult
 # Register your models here.
 admin.site.register(RawCsv)
-admin.site.register(Key)
\ No newline at end of file
+
+
+@admin.register(Key)
+class KeyAdmin(admin.ModelAdmin):
+    list_display = ('id', 'Client_Id', 'Approved', 'calls_today', 'daily_limit', 'usage_date', 'disabled_until', 'last_error')
+    list_filter = ('Approved',)
+    list_editable = ('Approved', 'daily_limit')
+    readonly_fields = ('calls_today', 'usage_date', 'disabled_until', 'last_error')
+
+
+@admin.register(MarketData)
+class MarketDataAdmin(admin.ModelAdmin):
+    list_display = ('search_term', 'avg_price', 'avg_shipping', 'volume', 'fetched_at')
+    search_fields = ('search_term',)
+
+
+@admin.register(PriceSnapshot)
+class PriceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('search_term', 'avg_price', 'avg_shipping', 'volume', 'taken_at')
+    search_fields = ('search_term',)
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('raw_csv', 'platform', 'status', 'processed', 'total', 'errors', 'created_at', 'finished_at')
+    list_filter = ('status', 'platform')
+
+
+@admin.register(AnalysisResult)
+class AnalysisResultAdmin(admin.ModelAdmin):
+    list_display = ('upc', 'title', 'raw_csv', 'platform', 'cost', 'avg_sold_price', 'estimated_profit', 'profit_margin', 'roi')
+    list_filter = ('platform',)
+    search_fields = ('upc', 'title', 'sku')
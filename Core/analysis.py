@@ -0,0 +1,159 @@
+import hashlib, json, traceback, logging
+import pandas as pd
+from . import market_cache, price_history
+from .market_data import get_provider
+
+logger = logging.getLogger(__name__)
+
+EBAY_FEE_PERCENTAGE = 0.13
+DEFAULT_SHIPPING_COST = 5.0
+WALMART_FEE_PERCENTAGE = 0.13
+
+
+def fetch_ebay_market_data(search_term, source=None, spend=None):
+    """(avg_price, avg_shipping, volume, link) from `source` ('active' or 'sold' listings)."""
+    return get_provider(source).fetch(search_term, spend)
+
+
+def fetch_and_cache(search_term, source=None, spend=None):
+    # Only successful lookups are cached; a failed fetch raises before market_cache.set
+    source = get_provider(source).name
+    data = fetch_ebay_market_data(search_term, source, spend)
+    market_cache.set(search_term, *data, source=source)
+    # The cache keeps only the latest lookup; the history keeps them all, for the trend columns
+    price_history.record(search_term, *data[:3], source=source)
+    return data
+
+
+def get_market_data(search_term, source=None):
+    source = get_provider(source).name
+    cached = market_cache.get(search_term, source)
+    if cached is not None:
+        return cached
+    return fetch_and_cache(search_term, source)
+
+
+def get_ebay_avg_price(search_term, cost, market_data=None):
+    try:
+        if market_data is None:
+            market_data = get_market_data(search_term)
+        avg_price, avg_shipping, total_volume, ebay_url = market_data
+        if not total_volume:
+            # No listings found
+            return 0.0, 0.0, 0.0, 0, '#'
+
+        estimated_profit = avg_price - avg_shipping - cost
+        roi = (estimated_profit / cost) * 100 if cost else 0.0
+
+        return (
+            avg_price,
+            avg_shipping,
+            roi,
+            total_volume,
+            ebay_url
+        )
+    except Exception as e:
+        logger.error(f"eBay fetch error for {search_term}: {e}")
+        return 0.0, 0.0, 0.0, 0, '#'
+
+
+
+def input_hashes(items, platform, col_names=None):
+    """
+    One fingerprint per row of the mapped items DataFrame, covering every input value.
+
+    Platform, column names and the optional-column mapping make up the hash key, so rows
+    analysed under a different mapping never match.
+    """
+    mapping = json.dumps([platform, list(items.columns), col_names or {}], sort_keys=True)
+    hash_key = hashlib.md5(mapping.encode()).hexdigest()[:16]
+    return [f'{h:016x}' for h in pd.util.hash_pandas_object(items, index=False, hash_key=hash_key)]
+
+
+def search_term_for(item_data):
+    # UPC when present, otherwise the product title
+    upc = str(item_data.get('UPC', '')).strip()
+    title = str(item_data.get('Title', '')).strip()
+    return upc if upc and upc.lower() not in ('nan', 'none', '') else title
+
+
+def process_item(item_data, platform="ebay",col_names=None,market_data=None):
+    # Optional fields from CSV; resolved first so the error row below can use them too
+    optional_name_1 = col_names.get("optional_name_1", "") if col_names else ""
+    optional_name_2 = col_names.get("optional_name_2", "") if col_names else ""
+    optional_name_3 = col_names.get("optional_name_3", "") if col_names else ""
+
+    try:
+        sku = item_data.get('SKU', '')
+        upc = str(item_data.get('UPC', '')).strip()
+        title = str(item_data.get('Title', '')).strip()
+        cost = float(item_data.get('Cost', 0) or 0.0)
+        actual_price = float(item_data.get('ActualPrice', cost) or cost)
+
+        optional_1 = item_data.get(optional_name_1, '')
+        optional_2 = item_data.get(optional_name_2, '')
+        optional_3 = item_data.get(optional_name_3, '')
+
+        search_term = search_term_for(item_data)
+
+        avg_price = avg_shipping = roi = volume = product_link = 0.0
+
+        if platform == "walmart":
+            pass
+        else:
+            avg_price, avg_shipping, roi, volume, product_link = get_ebay_avg_price(search_term, cost, market_data)
+
+        platform_fee_percentage = EBAY_FEE_PERCENTAGE if platform == "ebay" else WALMART_FEE_PERCENTAGE
+        platform_link_key = 'ebay_link' if platform == "ebay" else 'walmart_link'
+
+        estimated_fee = avg_price * platform_fee_percentage
+        estimated_shipping = avg_shipping if avg_shipping else DEFAULT_SHIPPING_COST
+        profit = avg_price - actual_price - estimated_fee - estimated_shipping
+        margin = (profit / avg_price * 100) if avg_price > 0 else 0
+
+        return {
+            'SKU': sku,
+            'UPC': upc,
+            'Title': title,
+            'Cost': round(cost, 2),
+            'ActualPrice': round(actual_price, 2),
+            'optional_1': optional_1,
+            'optional_2': optional_2,
+            'optional_3': optional_3,
+            'avg_sold_price': round(avg_price, 2),
+            'estimated_fees': round(estimated_fee, 2),
+            'estimated_shipping': round(estimated_shipping, 2),
+            'estimated_profit': round(profit, 2),
+            'profit_margin': round(margin, 2),
+            'roi': round(roi, 2),
+            'monthly_volume': volume,
+            platform_link_key: product_link,
+            'optional_1_name':optional_name_1,
+            'optional_2_name':optional_name_2,
+            'optional_3_name':optional_name_3,
+        }
+
+    except Exception as e:
+        logger.error(f"Error processing item: {traceback.format_exc()}")
+        return {
+            'SKU': item_data.get('SKU', ''),
+            'UPC': item_data.get('UPC', ''),
+            'Title': item_data.get('Title', ''),
+            'Cost': item_data.get('Cost', 0),
+            'ActualPrice': item_data.get('ActualPrice', 0),
+            'optional_1': item_data.get('optional_1', ''),
+            'optional_2': item_data.get('optional_2', ''),
+            'optional_3': item_data.get('optional_3', ''),
+            'error': str(e),
+            'avg_sold_price': 0,
+            'estimated_fees': 0,
+            'estimated_shipping': DEFAULT_SHIPPING_COST,
+            'estimated_profit': 0,
+            'profit_margin': 0,
+            'roi': 0,
+            'monthly_volume': 0,
+            'ebay_link' if platform == "ebay" else 'walmart_link': '#',
+            'optional_1_name':optional_name_1,
+            'optional_2_name':optional_name_2,
+            'optional_3_name':optional_name_3,
+        }
@@ -0,0 +1,163 @@
+import logging, os, shutil, time, uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_DIR = getattr(settings, 'ARTIFACT_DIR', os.path.join(settings.BASE_DIR, 'var', 'artifacts'))
+ARTIFACT_TTL = getattr(settings, 'ARTIFACT_TTL', 60 * 60 * 24 * 2)
+
+# An uploaded file as it arrived, kept next to (or instead of) Parquet parts
+SOURCE_FILE = 'source'
+
+
+def _path(artifact_id):
+    # Ids come back from sessions and job rows; never let one escape ARTIFACT_DIR
+    return os.path.join(ARTIFACT_DIR, str(uuid.UUID(str(artifact_id))))
+
+
+def _parts(artifact_id):
+    path = _path(artifact_id)
+    if not os.path.isdir(path):
+        return []
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.parquet')]
+
+
+def _stringify_mixed(df):
+    # Arrow needs one type per column; object columns mixing e.g. ints and strings become strings
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == 'object':
+            df[col] = df[col].map(lambda v: v if v is None or isinstance(v, str) or v != v else str(v))
+    return df
+
+
+class ArtifactWriter:
+    """
+    Appends DataFrames to an artifact as numbered Parquet parts.
+
+    Each chunk is its own part, so chunks with different inferred dtypes never have to share
+    one schema, and a part only becomes visible once it is completely written.
+    """
+
+    def __init__(self, artifact_id):
+        self.id = str(artifact_id)
+        self.path = _path(artifact_id)
+        os.makedirs(self.path, exist_ok=True)
+        self.part_count = len(_parts(artifact_id))
+
+    def append(self, df):
+        if df.empty:
+            return
+        part = os.path.join(self.path, f'part-{self.part_count:05d}.parquet')
+        df = df.reset_index(drop=True)
+        try:
+            df.to_parquet(part + '.tmp', engine='pyarrow', compression='zstd', index=False)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            _stringify_mixed(df).to_parquet(part + '.tmp', engine='pyarrow', compression='zstd', index=False)
+        os.replace(part + '.tmp', part)
+        self.part_count += 1
+
+
+def create(artifact_id=None):
+    return ArtifactWriter(artifact_id or uuid.uuid4())
+
+
+def save_file(file):
+    """Copy an uploaded file, byte for byte, into a new artifact; returns its id."""
+    writer = create()
+    path = os.path.join(writer.path, SOURCE_FILE)
+    file.seek(0)
+    with open(path + '.tmp', 'wb') as out:
+        shutil.copyfileobj(file, out, 1024 * 1024)
+    file.seek(0)
+    os.replace(path + '.tmp', path)
+    return writer.id
+
+
+def file_path(artifact_id):
+    return os.path.join(_path(artifact_id), SOURCE_FILE)
+
+
+def link(artifact_id):
+    """A new artifact with the same files, hard-linked where the filesystem allows."""
+    writer = create()
+    source = _path(artifact_id)
+    for name in os.listdir(source):
+        try:
+            os.link(os.path.join(source, name), os.path.join(writer.path, name))
+        except OSError:
+            shutil.copy2(os.path.join(source, name), os.path.join(writer.path, name))
+    return writer.id
+
+
+def open_writer(artifact_id):
+    """Continue appending to an existing artifact, e.g. a job checkpoint after a restart."""
+    return ArtifactWriter(artifact_id)
+
+
+def exists(artifact_id):
+    try:
+        return os.path.isdir(_path(artifact_id))
+    except ValueError:
+        return False
+
+
+def part_count(artifact_id):
+    return len(_parts(artifact_id))
+
+
+def iter_parts(artifact_id, columns=None, start=0):
+    """Yield one DataFrame per part from part `start` on, reading only `columns` from disk when given."""
+    for part in _parts(artifact_id)[start:]:
+        if columns is None:
+            yield pd.read_parquet(part, engine='pyarrow')
+        else:
+            available = pq.read_schema(part).names
+            df = pd.read_parquet(part, engine='pyarrow', columns=[c for c in columns if c in available])
+            yield df.reindex(columns=columns)
+
+
+def read(artifact_id, columns=None):
+    frames = list(iter_parts(artifact_id, columns))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def records(df):
+    """A part's rows as dicts, without the NaN padding added for keys a row never had."""
+    return [{k: v for k, v in row.items() if v is not None and v == v} for row in df.to_dict(orient='records')]
+
+
+def read_records(artifact_id):
+    rows = []
+    for df in iter_parts(artifact_id):
+        rows += records(df)
+    return rows
+
+
+def delete(artifact_id):
+    if artifact_id and exists(artifact_id):
+        shutil.rmtree(_path(artifact_id), ignore_errors=True)
+
+
+def evict(max_age=ARTIFACT_TTL, keep=()):
+    """Delete artifacts not written to for `max_age` seconds, except ids in `keep`."""
+    if not os.path.isdir(ARTIFACT_DIR):
+        return 0
+    keep = {str(k) for k in keep}
+    cutoff = time.time() - max_age
+    evicted = 0
+    for name in os.listdir(ARTIFACT_DIR):
+        path = os.path.join(ARTIFACT_DIR, name)
+        if name in keep or not os.path.isdir(path) or os.path.getmtime(path) >= cutoff:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        evicted += 1
+    if evicted:
+        logger.info(f"Evicted {evicted} stale artifacts")
+    return evicted
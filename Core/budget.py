@@ -0,0 +1,60 @@
+import pandas as pd
+from django.conf import settings
+
+from . import market_cache
+from .analysis import search_term_for
+from .models import AnalysisResult
+
+BUDGET_QUERY_BATCH = getattr(settings, 'BUDGET_QUERY_BATCH', 500)
+
+# Row error for rows left unpriced because the job's API-call budget went to other rows
+BUDGET_SKIPPED = 'Skipped: API call budget reached'
+
+
+def _previous_profit(upcs, platform):
+    """Estimated profit per UPC from the latest successful analysis of it, in any file."""
+    upcs = [upc for upc in dict.fromkeys(upcs) if upc]
+    profit = {}
+    for start in range(0, len(upcs), BUDGET_QUERY_BATCH):
+        rows = AnalysisResult.objects.filter(
+            upc__in=upcs[start:start + BUDGET_QUERY_BATCH], platform=platform, error__isnull=True,
+        ).order_by('id').values_list('upc', 'estimated_profit')
+        # Ordered by id, so the most recently saved row for a UPC wins
+        profit.update(rows)
+    return profit
+
+
+def priorities(items, platform):
+    """
+    A sort key per search term; the terms worth an API call most sort last.
+
+    Terms are ranked in three tiers, each summed over every row using the term:
+    UPCs that were profitable last time they were analysed (by that profit), then
+    terms never analysed or without market data last time (by ActualPrice, the cost after
+    the mapped discount, i.e. the money at stake), then UPCs that lost money last time.
+    """
+    records = items[[c for c in ('UPC', 'Title', 'ActualPrice') if c in items.columns]].to_dict(orient='records')
+    terms = [search_term_for(record) for record in records]
+    actual = pd.to_numeric(items['ActualPrice'], errors='coerce').fillna(0) if 'ActualPrice' in items.columns else None
+    previous = _previous_profit(terms, platform)
+
+    totals = {}
+    for i, term in enumerate(terms):
+        if previous.get(term):
+            key = (2, previous[term]) if previous[term] > 0 else (0, previous[term])
+        else:
+            key = (1, float(actual.iat[i]) if actual is not None else 0.0)
+        tier, value = totals.get(term, (key[0], 0.0))
+        totals[term] = (max(tier, key[0]), value + key[1])
+    return totals
+
+
+def plan(items, platform, source, calls):
+    """
+    The search terms the job may look up: every term with fresh cached market data, which
+    costs no call, plus the `calls` highest-priority terms that need one.
+    """
+    ranked = priorities(items, platform)
+    cached = market_cache.fresh_terms(ranked, source)
+    uncached = sorted((term for term in ranked if term not in cached), key=ranked.get, reverse=True)
+    return cached | set(uncached[:max(0, calls)])
@@ -0,0 +1,108 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from . import http_client
+
+logger = logging.getLogger(__name__)
+
+EBAY_OAUTH_URL = getattr(settings, 'EBAY_OAUTH_URL', 'https://api.ebay.com/identity/v1/oauth2/token')
+EBAY_SCOPE = 'https://api.ebay.com/oauth/api_scope'
+# Marketplace Insights (sold listings) is a limited-release API with its own scope
+EBAY_INSIGHTS_SCOPE = 'https://api.ebay.com/oauth/api_scope/buy.marketplace.insights'
+
+EBAY_TOKEN_STORE = getattr(settings, 'EBAY_TOKEN_STORE', os.path.join(settings.BASE_DIR, 'var', 'ebay_token.json'))
+EBAY_TOKEN_REFRESH_MARGIN = getattr(settings, 'EBAY_TOKEN_REFRESH_MARGIN', 300)
+
+
+class TokenManager:
+    """
+    Application token for one key's (client_id, client_secret) `credentials` and one OAuth
+    scope, shared by every thread and worker process.
+
+    Threads serialize on a lock and processes on an flock() of the store file, so only one
+    refresh is ever in flight; everyone else picks up the token it wrote.
+    """
+
+    def __init__(self, credentials, store_path=EBAY_TOKEN_STORE, refresh_margin=EBAY_TOKEN_REFRESH_MARGIN,
+                 scope=EBAY_SCOPE):
+        self.credentials = credentials
+        self.store_path = store_path
+        self.refresh_margin = refresh_margin
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+
+    def _store_key(self, client_id):
+        # Base-scope tokens keep the plain client id, as store files written before scopes did
+        return client_id if self.scope == EBAY_SCOPE else f'{client_id} {self.scope}'
+
+    def _is_fresh(self, expires_at):
+        return expires_at - self.refresh_margin > time.time()
+
+    def get_token(self):
+        token = self._token
+        if token and self._is_fresh(self._expires_at):
+            return token
+        with self._lock:
+            if not (self._token and self._is_fresh(self._expires_at)):
+                self._refresh(stale=None)
+            return self._token
+
+    def invalidate(self, token):
+        """Handle a 401 for `token`: refresh once, no matter how many callers saw it fail."""
+        with self._lock:
+            if token == self._token:
+                self._refresh(stale=token)
+            return self._token
+
+    def _refresh(self, stale):
+        client_id, client_secret = self.credentials
+        os.makedirs(os.path.dirname(self.store_path), exist_ok=True)
+        with open(self.store_path + '.lock', 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                store = self._read_store()
+                shared = store.get(self._store_key(client_id))
+                if shared and shared['token'] != stale and self._is_fresh(shared['expires_at']):
+                    self._token, self._expires_at = shared['token'], shared['expires_at']
+                    return
+
+                token, expires_at = self._request_token(client_id, client_secret)
+                store[self._store_key(client_id)] = {'token': token, 'expires_at': expires_at}
+                self._write_store(store)
+                self._token, self._expires_at = token, expires_at
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _request_token(self, client_id, client_secret):
+        response = http_client.post(
+            EBAY_OAUTH_URL,
+            headers={'Content-Type': 'application/x-www-form-urlencoded'},
+            data={'grant_type': 'client_credentials', 'scope': self.scope},
+            auth=(client_id, client_secret)
+        )
+        response.raise_for_status()
+        result = response.json()
+        logger.info(f"Minted eBay token for {client_id[:8]}…, expires in {result.get('expires_in')}s")
+        return result['access_token'], time.time() + float(result.get('expires_in', 7200))
+
+    def _read_store(self):
+        try:
+            with open(self.store_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write_store(self, store):
+        tmp_path = f"{self.store_path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(store, f)
+        os.replace(tmp_path, self.store_path)
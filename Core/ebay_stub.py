@@ -0,0 +1,172 @@
+import hashlib, json, random, sys, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .ebay_auth import EBAY_INSIGHTS_SCOPE
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients going away mid-response (e.g. a server under test being stopped) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class StubEbayServer:
+    """
+    Local stand-in for the eBay OAuth token, Browse search and Marketplace Insights sales endpoints.
+
+    A search always returns the same listings for the same term, so runs are comparable.
+    `latency` (+ up to `jitter`) seconds are added to every search; `error_rate` and
+    `throttle_rate` are the chances of a 500 or a 429, and `rate_limit` requests/second
+    per access token (0 = none) is enforced with 429 + Retry-After like the real API, so
+    several API keys get several times the throughput. Sales searches need a token minted
+    with the Marketplace Insights scope, or get a 403 as from eBay.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.0, error_rate=0.0, throttle_rate=0.0, rate_limit=0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._windows = {}  # access token -> (second, requests in it)
+        self._scopes = {}  # access token -> scopes it was minted with
+        self.counts = {'oauth': 0, 'search': 0, 'ok': 0, 'errors': 0, 'throttled': 0}
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def oauth_url(self):
+        return self.base_url + '/identity/v1/oauth2/token'
+
+    @property
+    def search_url(self):
+        return self.base_url + '/buy/browse/v1/item_summary/search'
+
+    @property
+    def sales_url(self):
+        return self.base_url + '/buy/marketplace_insights/v1_beta/item_sales/search'
+
+    def start(self, host='127.0.0.1', port=0):
+        self._server = _Server((host, port), _handler(self))
+        threading.Thread(target=self._server.serve_forever, name='ebay-stub', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _count(self, key):
+        with self._lock:
+            self.counts[key] += 1
+
+    def _outcome(self, token):
+        """Status code for the next search made with `token`: 200, 429 or 500."""
+        with self._lock:
+            second = int(time.monotonic())
+            window_second, requests = self._windows.get(token, (0, 0))
+            requests = requests + 1 if window_second == second else 1
+            self._windows[token] = (second, requests)
+            roll = self._random.random()
+        if self.rate_limit and requests > self.rate_limit:
+            return 429
+        if roll < self.throttle_rate:
+            return 429
+        if roll < self.throttle_rate + self.error_rate:
+            return 500
+        return 200
+
+    @staticmethod
+    def listings(term):
+        """Deterministic search results for `term`; about one term in eleven has none."""
+        digest = hashlib.md5(term.encode()).digest()
+        count = digest[0] % 11
+        base = 10 + digest[1] % 190
+        return [
+            {
+                'itemId': f'v1|{digest.hex()[:12]}{i}|0',
+                'price': {'value': f'{base + (digest[2 + i] % 40) - 20 + 0.99:.2f}', 'currency': 'USD'},
+                'shippingOptions': [{'shippingCost': {'value': f'{digest[12 + i % 4] % 12:.2f}', 'currency': 'USD'}}],
+                'itemWebUrl': f'https://www.ebay.com/itm/{int.from_bytes(digest[:5], "big")}{i}',
+            }
+            for i in range(count)
+        ]
+
+    @classmethod
+    def sales(cls, term):
+        """Deterministic sold items for `term`, shaped like Marketplace Insights itemSales."""
+        sales = cls.listings(term)
+        for i, sale in enumerate(sales):
+            sale['lastSoldPrice'] = sale.pop('price')
+            sale['totalSoldQuantity'] = 1 + i % 3
+        return sales
+
+
+def _handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so the pooled client reuses connections as it would against eBay
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            form = parse_qs(self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode())
+            stub._count('oauth')
+            token = f'stub-{time.time_ns()}'
+            with stub._lock:
+                stub._scopes[token] = set(form.get('scope', [''])[0].split())
+            self._send(200, {'access_token': token, 'expires_in': 7200, 'token_type': 'Application Access Token'})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            stub._count('search')
+            delay = stub.latency + (stub._random.uniform(0, stub.jitter) if stub.jitter else 0)
+            if delay:
+                time.sleep(delay)
+
+            authorization = self.headers.get('Authorization', '')
+            status = stub._outcome(authorization)
+            if url.path.endswith('/item_sales/search') and EBAY_INSIGHTS_SCOPE not in stub._scopes.get(
+                authorization.removeprefix('Bearer '), (),
+            ):
+                stub._count('errors')
+                self._send(403, {'errors': [{'errorId': 1100, 'message': 'Access denied', 'longMessage': 'Insufficient permissions to fulfill the request.'}]})
+            elif status == 429:
+                stub._count('throttled')
+                self._send(429, {'errors': [{'errorId': 2001, 'message': 'Too many requests'}]}, {'Retry-After': '1'})
+            elif status == 500:
+                stub._count('errors')
+                self._send(500, {'errors': [{'errorId': 10001, 'message': 'Internal error'}]})
+            else:
+                stub._count('ok')
+                term = parse_qs(url.query).get('q', [''])[0]
+                if url.path.endswith('/item_sales/search'):
+                    sales = stub.sales(term)
+                    self._send(200, {'total': len(sales), 'itemSales': sales} if sales else {'total': 0})
+                else:
+                    items = stub.listings(term)
+                    self._send(200, {'total': len(items), 'itemSummaries': items} if items else {'total': 0})
+
+        def _send(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
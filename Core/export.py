@@ -0,0 +1,151 @@
+import csv
+import io
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+
+from .results import filter_results, order_results
+
+EXPORT_CHUNK_ROWS = getattr(settings, 'EXPORT_CHUNK_ROWS', 2000)
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+# Columns the analysis table shows, in its order; the optional ones take their mapped names
+COLUMNS = [
+    'SKU', 'UPC', 'Title', 'Cost', 'ActualPrice', 'optional_1', 'optional_2', 'optional_3',
+    'avg_sold_price', 'estimated_fees', 'estimated_shipping', 'estimated_profit', 'profit_margin',
+    'roi', 'monthly_volume', 'avg_price_7d', 'avg_price_30d', 'price_trend', 'link', 'error',
+]
+OPTIONAL_COLUMNS = ('optional_1', 'optional_2', 'optional_3')
+
+# XML 1.0 cannot carry most control characters, so they are dropped from XLSX cells
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def export_rows(instance, platform, params):
+    """All of a file's results for `platform`, filtered and sorted like the analyze page."""
+    return order_results(filter_results(instance.results.filter(platform=platform), params), params)
+
+
+def header(platform, first):
+    """Column titles, with the optional columns named after the sheet columns they came from."""
+    titles = dict(zip(COLUMNS, COLUMNS), link=f'{platform}_link')
+    if first is not None:
+        for key in OPTIONAL_COLUMNS:
+            titles[key] = getattr(first, f'{key}_name') or key
+    return [titles[key] for key in COLUMNS]
+
+
+def _values(result):
+    row = result.as_row()
+    row['link'] = result.link
+    return ['' if row.get(key) is None else row[key] for key in COLUMNS]
+
+
+def stream_csv(titles, rows):
+    """Yield the CSV a chunk of rows at a time; memory stays flat however many rows there are."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(titles)
+    for i, result in enumerate(rows.iterator(chunk_size=EXPORT_CHUNK_ROWS), 1):
+        writer.writerow(_values(result))
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+class _Sink:
+    """Write-only file that hands everything written to it back out; the zip is never seeked."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def _cell(value):
+    if isinstance(value, bool):
+        value = str(value)
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value!r}</v></c>' if value == value else '<c/>'
+    text = escape(_XML_ILLEGAL.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _row(values):
+    return '<row>' + ''.join(_cell(v) for v in values) + '</row>'
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Analysis" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def stream_xlsx(titles, rows):
+    """
+    Yield an XLSX workbook as it is written.
+
+    The sheet uses inline strings rather than a shared-string table, so nothing has to be
+    held back until the end, and the zip goes to a write-only sink so each compressed chunk
+    can be sent as soon as it exists.
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, xml in _XLSX_PARTS.items():
+            workbook.writestr(name, xml)
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_row(titles).encode())
+            for i, result in enumerate(rows.iterator(chunk_size=EXPORT_CHUNK_ROWS), 1):
+                sheet.write(_row(_values(result)).encode())
+                if i % EXPORT_CHUNK_ROWS == 0:
+                    yield sink.drain()
+            sheet.write(b'</sheetData></worksheet>')
+        yield sink.drain()
+    yield sink.drain()
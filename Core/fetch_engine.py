@@ -0,0 +1,307 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+from .http_client import EBAY_MAX_WORKERS
+
+logger = logging.getLogger(__name__)
+
+EBAY_RATE_LIMIT = getattr(settings, 'EBAY_RATE_LIMIT', 25)
+EBAY_RATE_BURST = getattr(settings, 'EBAY_RATE_BURST', 50)
+EBAY_PROCESS_RATE_LIMIT = getattr(settings, 'EBAY_PROCESS_RATE_LIMIT', 250)
+EBAY_PROCESS_RATE_BURST = getattr(settings, 'EBAY_PROCESS_RATE_BURST', 500)
+EBAY_RETRY_ATTEMPTS = getattr(settings, 'EBAY_RETRY_ATTEMPTS', 4)
+EBAY_RETRY_BASE_DELAY = getattr(settings, 'EBAY_RETRY_BASE_DELAY', 0.5)
+EBAY_RETRY_MAX_DELAY = getattr(settings, 'EBAY_RETRY_MAX_DELAY', 30)
+EBAY_BREAKER_THRESHOLD = getattr(settings, 'EBAY_BREAKER_THRESHOLD', 10)
+EBAY_BREAKER_COOLDOWN = getattr(settings, 'EBAY_BREAKER_COOLDOWN', 30)
+EBAY_WORKER_CLOSE_TIMEOUT = getattr(settings, 'EBAY_WORKER_CLOSE_TIMEOUT', 30)
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    """Timeouts, dropped connections, throttling and 5xx are worth retrying; anything else is not."""
+    if getattr(error, 'rotated', False):
+        # The key pool took the failing key out of rotation; another key can take the call
+        return True
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code in RETRYABLE_STATUS
+
+
+def retry_after(error):
+    """Seconds asked for by a Retry-After header on the failed response, if any."""
+    response = getattr(error, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, wait_hint=None, base=EBAY_RETRY_BASE_DELAY, cap=EBAY_RETRY_MAX_DELAY):
+    """Full-jitter exponential backoff, but never shorter than what the server asked for."""
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    return max(delay, wait_hint or 0.0)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by every event loop in the process.
+
+    acquire() reserves the next free slot and sleeps until it comes up, so concurrent
+    analyses draw on the same budget instead of each getting their own.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def tokens(self):
+        """Tokens available right now, without taking one."""
+        with self._lock:
+            return min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait:
+            await asyncio.sleep(wait)
+
+
+# Ceiling for the whole process; each API key also has its own bucket in the key pool
+rate_limiter = TokenBucket(EBAY_PROCESS_RATE_LIMIT, EBAY_PROCESS_RATE_BURST)
+
+
+class CircuitBreaker:
+    """
+    Pauses every eBay call in the process while eBay is throttling or failing.
+
+    A Retry-After opens it for that long; otherwise `threshold` retryable failures in a row
+    open it for `cooldown` seconds. Once the pause is over a single probe call goes first:
+    success closes the breaker, another failure reopens it, and a probe that ends without
+    either must be handed back with release().
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._open_until = 0.0
+        # Token of the caller currently probing, if any
+        self._probe = None
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        """(delay, probe): delay 0 if the caller may go ahead now, probe set if it goes as the probe."""
+        with self._lock:
+            remaining = self._open_until - time.monotonic()
+            if remaining > 0:
+                return remaining, None
+            if self.failures < self.threshold:
+                return 0, None
+            if self._probe is not None:
+                return 0.1, None
+            self._probe = object()
+            return 0, self._probe
+
+    async def wait(self):
+        """Wait until a call may go ahead; returns the probe token if this call is the probe, else None."""
+        while True:
+            delay, probe = self._admit()
+            if not delay:
+                return probe
+            await asyncio.sleep(delay)
+
+    def release(self, probe):
+        """Let another caller probe; for a probe that ended without a success or failure to record."""
+        with self._lock:
+            if probe is not None and self._probe is probe:
+                self._probe = None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probe = None
+
+    def record_failure(self, wait_hint=None):
+        with self._lock:
+            self.failures += 1
+            self._probe = None
+            pause = wait_hint or (self.cooldown if self.failures >= self.threshold else 0)
+            if not pause:
+                return
+            now = time.monotonic()
+            if self._open_until <= now:
+                logger.warning(f"Pausing eBay calls for {pause:.1f}s after {self.failures} failed call(s)")
+                metrics.inc('csvanalyzer_breaker_opened_total')
+            self._open_until = max(self._open_until, now + pause)
+
+
+breaker = CircuitBreaker(EBAY_BREAKER_THRESHOLD, EBAY_BREAKER_COOLDOWN)
+
+
+class SingleFlight:
+    """
+    At most one call per key in flight across the process.
+
+    The first caller for a key runs the call; anyone asking for the same key meanwhile, from
+    any analysis and any event loop, awaits that call's result (or error) instead. The
+    shared future is thread-safe, so it can be awaited from every job's own loop.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+    async def run(self, key, call):
+        """(result, coalesced): `call()` is awaited only if no call for `key` is already running."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            metrics.inc('csvanalyzer_lookups_coalesced_total')
+            return await asyncio.wrap_future(future), True
+
+        try:
+            result = await call()
+        except BaseException as e:
+            # Waiters in other analyses get the error, never this task's cancellation
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Shared lookup was cancelled"))
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+single_flight = SingleFlight()
+
+
+class FetchEngine:
+    """
+    Runs one `lookup(engine, item)` coroutine per item and returns the results in input order.
+
+    Blocking work goes through run() (concurrency-bounded) or call() (also rate limited,
+    retried and subject to the circuit breaker), so only calls that actually reach eBay
+    spend rate-limit tokens.
+    """
+
+    def __init__(self, concurrency=EBAY_MAX_WORKERS, limiter=rate_limiter, breaker=breaker, attempts=EBAY_RETRY_ATTEMPTS):
+        self.concurrency = concurrency
+        self.limiter = limiter
+        self.breaker = breaker
+        self.attempts = attempts
+        self._executor = None
+        self._semaphore = None
+        # Worker threads that have run blocking work, and so may hold a DB connection
+        self._workers = set()
+
+    def map(self, lookup, items):
+        return asyncio.run(self._gather(lookup, items))
+
+    async def _gather(self, lookup, items):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            self._executor = executor
+            try:
+                return await asyncio.gather(*(lookup(self, item) for item in items))
+            finally:
+                self._executor = None
+                self._close_connections(executor)
+
+    def _close_connections(self, executor):
+        """Close the DB connection of every worker thread that ran work, from that thread."""
+        if not self._workers:
+            return
+        # Each close waits at the barrier until all have started, so no thread takes two
+        barrier = threading.Barrier(len(self._workers))
+
+        def close():
+            connection.close()
+            try:
+                barrier.wait(timeout=EBAY_WORKER_CLOSE_TIMEOUT)
+            except threading.BrokenBarrierError:
+                pass
+
+        wait([executor.submit(close) for _ in self._workers])
+        self._workers.clear()
+
+    def _work(self, fn, *args):
+        self._workers.add(threading.get_ident())
+        return fn(*args)
+
+    async def run(self, fn, *args):
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._work, fn, *args)
+
+    async def call(self, fn, *args, spend=None):
+        """
+        Rate-limited call, retried with backoff on retryable errors; the last error is raised.
+
+        `spend()`, when given, is called before every retry and returns False once the caller's
+        budget is used up; the last error is then raised instead of retrying.
+        """
+        error = None
+        for attempt in range(self.attempts):
+            if attempt and spend is not None and not spend():
+                raise error
+            probe = await self.breaker.wait()
+            try:
+                await self.limiter.acquire()
+                result = await self.run(fn, *args)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                error = e
+                if getattr(e, 'rotated', False) and attempt < self.attempts - 1:
+                    # A bad key says nothing about eBay; another key is tried straight away
+                    continue
+                wait_hint = retry_after(e)
+                self.breaker.record_failure(wait_hint)
+                if attempt == self.attempts - 1:
+                    raise
+                metrics.inc('csvanalyzer_ebay_retries_total')
+                await asyncio.sleep(backoff_delay(attempt, wait_hint))
+            else:
+                self.breaker.record_success()
+                return result
+            finally:
+                # A probe that ended without a verdict (a non-retryable error, a rotated key,
+                # cancellation) is handed back, or every later call would wait on it forever
+                self.breaker.release(probe)
@@ -0,0 +1,59 @@
+import threading, time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from . import metrics
+
+EBAY_MAX_WORKERS = getattr(settings, 'EBAY_MAX_WORKERS', 15)
+EBAY_CONNECT_TIMEOUT = getattr(settings, 'EBAY_CONNECT_TIMEOUT', 5)
+EBAY_READ_TIMEOUT = getattr(settings, 'EBAY_READ_TIMEOUT', 20)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide keep-alive session; one pooled connection per concurrent worker."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=EBAY_MAX_WORKERS, pool_block=True)
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+                _session = session
+    return _session
+
+
+def _endpoint(url):
+    # Last path segment, e.g. "search" or "token"; keeps the metric labels few and query-free
+    return urlparse(url).path.rstrip('/').rsplit('/', 1)[-1] or 'root'
+
+
+def request(method, url, **kwargs):
+    """Pooled request with the default timeout; latency and status are recorded per endpoint."""
+    kwargs.setdefault('timeout', (EBAY_CONNECT_TIMEOUT, EBAY_READ_TIMEOUT))
+    endpoint = _endpoint(url)
+    started = time.perf_counter()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except requests.RequestException as e:
+        metrics.inc('csvanalyzer_ebay_responses_total', endpoint=endpoint, status=type(e).__name__)
+        raise
+    finally:
+        metrics.observe('csvanalyzer_ebay_request_seconds', time.perf_counter() - started, endpoint=endpoint)
+    metrics.inc('csvanalyzer_ebay_responses_total', endpoint=endpoint, status=str(response.status_code))
+    return response
+
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
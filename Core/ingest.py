@@ -0,0 +1,151 @@
+import codecs, csv, io, logging
+
+import pandas as pd
+from django.conf import settings
+
+from . import artifacts
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SNIFF_BYTES = getattr(settings, 'UPLOAD_SNIFF_BYTES', 256 * 1024)
+UPLOAD_CHUNK_ROWS = getattr(settings, 'UPLOAD_CHUNK_ROWS', 20000)
+UPLOAD_PREVIEW_ROWS = getattr(settings, 'UPLOAD_PREVIEW_ROWS', 20)
+
+PRICE_INDICATORS = ['retail', 'w/s', 'cost', 'cog']
+
+
+def sniff(file):
+    """Return (encoding, header_row) from the first bytes of an upload; header_row is None if no UPC line."""
+    file.seek(0)
+    sample = file.read(UPLOAD_SNIFF_BYTES)
+    file.seek(0)
+
+    try:
+        # Incremental decode so a multi-byte character cut off at the end of the sample is not an error
+        text = codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        encoding = 'utf-8'
+    except UnicodeDecodeError:
+        text = sample.decode('latin-1')
+        encoding = 'latin-1'
+
+    # Counted in CSV records, as read_csv(skiprows=...) skips them: quoted cells may span lines,
+    # and only \r and \n end a line (str.splitlines() also splits on characters like U+0085)
+    records = csv.reader(io.StringIO(text, newline=''))
+    try:
+        for i, record in enumerate(records):
+            if any('UPC' in cell for cell in record):
+                return encoding, i
+    except csv.Error:
+        # Not CSV the csv module can read, e.g. a cell over its field size limit
+        pass
+    return encoding, None
+
+
+def clean_chunk(df):
+    df = df.dropna(how='all')
+
+    for col in df.columns:
+        if df[col].dtype == 'object':
+            if any(price_indicator in col.lower() for price_indicator in PRICE_INDICATORS):
+                df[col] = df[col].astype(str).str.replace('$', '').str.replace(',', '').str.strip()
+                try:
+                    df[col] = pd.to_numeric(df[col], errors='coerce')
+                except:
+                    pass
+            else:
+                df[col] = df[col].astype(str).str.strip()
+
+    df.columns = df.columns.str.strip().str.lower()
+    return df
+
+
+def read_chunks(file, encoding, header_row, chunksize=UPLOAD_CHUNK_ROWS, usecols=None):
+    """Yield cleaned DataFrames of at most `chunksize` rows, parsing only `usecols` when given."""
+    file.seek(0)
+    # pandas does not reliably honour `encoding` for binary upload handles, so decode here
+    text = io.TextIOWrapper(file, encoding=encoding, newline='')
+    try:
+        for chunk in pd.read_csv(text, skiprows=header_row, chunksize=chunksize, usecols=usecols):
+            yield clean_chunk(chunk)
+    finally:
+        text.detach()
+
+
+def _kind(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'boolean'
+    return 'number' if pd.api.types.is_numeric_dtype(series) else 'text'
+
+
+def preview(file, encoding, header_row, rows=UPLOAD_PREVIEW_ROWS):
+    """
+    Column names, inferred types and the first `rows` rows of an upload, for the mapping step.
+
+    Only those rows are parsed; the full parse happens once, in the analysis job.
+    """
+    file.seek(0)
+    text = io.TextIOWrapper(file, encoding=encoding, errors='replace', newline='')
+    try:
+        df = clean_chunk(pd.read_csv(text, skiprows=header_row, nrows=rows))
+    finally:
+        text.detach()
+    sample = df.astype(object).where(df.notna(), None)
+    return {
+        'columns': list(df.columns),
+        'dtypes': {col: _kind(df[col]) for col in df.columns},
+        'sample': sample.to_dict(orient='records'),
+    }
+
+
+MAPPED_FIELDS = ('upc_col', 'sku_col', 'title_col', 'cost_col', 'optional_1', 'optional_2', 'optional_3')
+
+
+def mapped_columns(fields):
+    """The sheet columns the user mapped, each once."""
+    return list(dict.fromkeys(fields[key] for key in MAPPED_FIELDS if fields.get(key)))
+
+
+def map_items(df, fields, discount_percentage=0.0):
+    """The item columns analysis works on (UPC, SKU, Title, Cost, ActualPrice, optionals) from a cleaned chunk."""
+    # UPC is required
+    items = pd.DataFrame({'UPC': df[fields['upc_col']]})
+    if fields.get('sku_col'):
+        items['SKU'] = df[fields['sku_col']]
+    if fields.get('title_col'):
+        items['Title'] = df[fields['title_col']]
+    if fields.get('cost_col'):
+        items['Cost'] = pd.to_numeric(df[fields['cost_col']].replace(r'[\$,]', '', regex=True), errors='coerce').fillna(0)
+    else:
+        items['Cost'] = 0
+    items['ActualPrice'] = items['Cost'] * (1 - discount_percentage / 100)
+    for key in ('optional_1', 'optional_2', 'optional_3'):
+        col_name = fields.get(key)
+        if col_name and col_name not in items.columns:
+            items[col_name] = df[col_name]
+    return items
+
+
+def load_items(artifact_id, encoding, header_row, fields, discount_percentage=0.0):
+    """
+    Parse a stored upload into the item DataFrame, reading only the mapped columns.
+
+    If a byte sequence past the sniffed sample turns out not to be UTF-8, the whole file is
+    re-read as latin-1.
+    """
+    try:
+        return _load(artifact_id, encoding, header_row, fields, discount_percentage)
+    except UnicodeDecodeError:
+        if encoding == 'latin-1':
+            raise
+        logger.info(f"Upload {artifact_id} is not UTF-8, re-reading as latin-1")
+        return _load(artifact_id, 'latin-1', header_row, fields, discount_percentage)
+
+
+def _load(artifact_id, encoding, header_row, fields, discount_percentage):
+    wanted = set(mapped_columns(fields))
+    with open(artifacts.file_path(artifact_id), 'rb') as file:
+        chunks = read_chunks(file, encoding, header_row, usecols=lambda name: str(name).strip().lower() in wanted)
+        frames = [map_items(chunk, fields, discount_percentage) for chunk in chunks]
+    if not frames:
+        return map_items(pd.DataFrame(columns=list(wanted)), fields, discount_percentage)
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,179 @@
+import asyncio
+import functools
+import time
+import weakref
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+
+from . import artifacts, jobs
+from .models import AnalysisJob, AnalysisResult
+
+ANALYSIS_STREAM_POLL = getattr(settings, 'ANALYSIS_STREAM_POLL', 0.25)
+ANALYSIS_STREAM_KEEPALIVE = getattr(settings, 'ANALYSIS_STREAM_KEEPALIVE', 15)
+ANALYSIS_STREAM_BATCH_ROWS = getattr(settings, 'ANALYSIS_STREAM_BATCH_ROWS', 500)
+ANALYSIS_STREAM_CACHE_PARTS = getattr(settings, 'ANALYSIS_STREAM_CACHE_PARTS', 256)
+
+
+def frame(event, data, event_id=None):
+    """One Server-Sent Events frame; `data` is sent as JSON."""
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {event}\n'.encode() + b'data: ' + orjson.dumps(data) + b'\n\n'
+
+
+def _rows_frame(payload, event_id):
+    return f'id: {event_id}\nevent: rows\n'.encode() + b'data: {"rows":' + payload + b'}\n\n'
+
+
+def _failed(row):
+    return str(row.get('error') or '').startswith(jobs.LOOKUP_FAILED)
+
+
+@functools.lru_cache(maxsize=ANALYSIS_STREAM_CACHE_PARTS)
+def _part(job_id, index, first_row, platform):
+    """
+    Checkpoint part `index` as (row count, encoded rows, row numbers whose lookup failed).
+
+    Parts never change once written, so every stream following the job shares one read and
+    encoding of each; a browser opening the page mid-job costs no more than one that was there.
+    """
+    rows = artifacts.records(next(artifacts.iter_parts(job_id, start=index)))
+    out = []
+    for row_number, row in enumerate(rows, first_row):
+        # The same shape the analyze page gets from the database, plus the row's place in the file
+        result = AnalysisResult.from_row(None, platform, row).as_row()
+        result['row_number'] = row_number
+        out.append(result)
+    return len(rows), orjson.dumps(out), [first_row + i for i, row in enumerate(rows) if _failed(row)]
+
+
+# Per event loop: job id -> (when fetched, task fetching the job), shared by its streams
+_polls = weakref.WeakKeyDictionary()
+
+
+async def _poll(job_id):
+    """
+    The job's current row, read at most once per ANALYSIS_STREAM_POLL however many streams follow it.
+    """
+    polls = _polls.setdefault(asyncio.get_running_loop(), {})
+    now = time.monotonic()
+    fetched = polls.get(job_id)
+    if fetched is None or now - fetched[0] >= ANALYSIS_STREAM_POLL:
+        for stale in [key for key, (at, _) in polls.items() if now - at >= ANALYSIS_STREAM_POLL * 4]:
+            del polls[stale]
+        fetched = polls[job_id] = now, asyncio.ensure_future(
+            AnalysisJob.objects.select_related('raw_csv').aget(id=job_id)
+        )
+    # A stream that hangs up must not cancel the read the others are waiting on
+    return await asyncio.shield(fetched[1])
+
+
+# Job id -> when a stream last resubmitted it, so open streams do not flood the job queue
+_recovered = {}
+
+
+def _recover(job):
+    """
+    Resubmit a job whose worker stopped sending heartbeats, at most once per
+    ANALYSIS_JOB_STALE_AFTER per process however many streams follow it.
+
+    The page only polls job_status when it cannot stream, so a stale job would otherwise
+    wait for runjobs.
+    """
+    if not jobs.is_stale(job):
+        return
+    now = time.monotonic()
+    last = _recovered.get(job.id)
+    if last is not None and now - last < jobs.ANALYSIS_JOB_STALE_AFTER:
+        return
+    _recovered[job.id] = now
+    jobs.submit(job.id)
+
+
+def _read_parts(job_id, start, first_row, platform):
+    """_part() of each checkpoint part from part `start` on; stops early if the checkpoint goes away."""
+    parts = []
+    try:
+        for index in range(start, artifacts.part_count(job_id)):
+            parts.append(_part(job_id, index, first_row, platform))
+            first_row += parts[-1][0]
+    except (OSError, StopIteration):
+        # The job finished and removed its checkpoint while it was being read;
+        # the next pass sees it done and sends the rest from the database
+        pass
+    return parts
+
+
+async def stream(job, start=0):
+    """
+    Yield a job's progress and result rows as Server-Sent Events until it finishes.
+
+    Rows are read from the job's checkpoint, so they arrive a chunk at a time as soon as
+    each chunk is priced, whichever worker process runs the job. Each `rows` event carries
+    the number of rows delivered so far as its id; a reconnecting browser sends it back as
+    Last-Event-ID and the stream carries on from `start`, beginning with the whole chunk that
+    holds it (rows carry their row_number, so a repeated row just replaces the earlier copy).
+    Once the job is done, rows whose lookup was retried at the end are sent again as they
+    were finally saved, followed by a `done` (or `failed`) event with the job's progress.
+    """
+    parts = sent = 0
+    retried = []
+    last_progress = None
+    last_frame = time.monotonic()
+    while True:
+        job = await _poll(job.id)
+        _recover(job)
+
+        # A chunk is checkpointed before the job counts it, so there is nothing new to read until then
+        if job.status not in ('done', 'failed') and job.processed > sent:
+            # Parquet reads happen in a thread; the event loop only waits for them
+            for count, payload, failed in await sync_to_async(_read_parts, thread_sensitive=False)(
+                str(job.id), parts, sent, job.platform,
+            ):
+                parts += 1
+                sent += count
+                if sent <= start:
+                    continue
+                retried += failed
+                last_frame = time.monotonic()
+                yield _rows_frame(payload, sent)
+
+        # Only when the job has moved on; the ETA alone changes on every poll
+        progress = (job.status, job.processed, job.errors, job.summary)
+        if progress != last_progress:
+            last_progress = progress
+            last_frame = time.monotonic()
+            yield frame('progress', jobs.progress(job))
+
+        if job.status == 'failed':
+            yield frame('failed', jobs.progress(job))
+            return
+        if job.status == 'done':
+            async for chunk in _final_rows(job, max(sent, start), retried):
+                yield chunk
+            yield frame('done', jobs.progress(job))
+            return
+
+        if time.monotonic() - last_frame >= ANALYSIS_STREAM_KEEPALIVE:
+            # A comment line, so proxies do not close an idle connection
+            last_frame = time.monotonic()
+            yield b': keepalive\n\n'
+        await asyncio.sleep(ANALYSIS_STREAM_POLL)
+
+
+async def _final_rows(job, sent, retried):
+    """Saved rows the stream has not sent yet, and the final version of retried ones."""
+    pending = job.raw_csv.results.filter(Q(row_number__gte=sent) | Q(row_number__in=retried), platform=job.platform)
+    batch = []
+    async for result in pending.order_by('row_number').aiterator(chunk_size=ANALYSIS_STREAM_BATCH_ROWS):
+        row = result.as_row()
+        row['row_number'] = result.row_number
+        batch.append(row)
+        sent = max(sent, result.row_number + 1)
+        if len(batch) == ANALYSIS_STREAM_BATCH_ROWS:
+            yield frame('rows', {'rows': batch}, event_id=sent)
+            batch = []
+    if batch:
+        yield frame('rows', {'rows': batch}, event_id=sent)
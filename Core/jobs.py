@@ -0,0 +1,424 @@
+import json, logging, threading, time, traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pandas as pd
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import artifacts, budget, ingest, market_cache, metrics, price_history
+from .analysis import fetch_and_cache, input_hashes, search_term_for
+from .fetch_engine import FetchEngine, single_flight
+from .market_data import get_provider
+from .models import AnalysisJob, AnalysisResult
+from .pricing import compute_metrics
+
+logger = logging.getLogger(__name__)
+
+ANALYSIS_JOB_WORKERS = getattr(settings, 'ANALYSIS_JOB_WORKERS', 2)
+ANALYSIS_JOB_CHUNK_SIZE = getattr(settings, 'ANALYSIS_JOB_CHUNK_SIZE', 200)
+ANALYSIS_JOB_FIRST_CHUNK_SIZE = getattr(settings, 'ANALYSIS_JOB_FIRST_CHUNK_SIZE', 25)
+ANALYSIS_JOB_STALE_AFTER = getattr(settings, 'ANALYSIS_JOB_STALE_AFTER', 120)
+ANALYSIS_JOB_HEARTBEAT = getattr(settings, 'ANALYSIS_JOB_HEARTBEAT', 15)
+ANALYSIS_RESULT_BATCH_SIZE = getattr(settings, 'ANALYSIS_RESULT_BATCH_SIZE', 500)
+ARTIFACT_EVICT_INTERVAL = getattr(settings, 'ARTIFACT_EVICT_INTERVAL', 60 * 60)
+
+# Prefix of the row error for rows whose market data could not be fetched
+LOOKUP_FAILED = 'Market lookup failed'
+
+_executor = ThreadPoolExecutor(max_workers=ANALYSIS_JOB_WORKERS, thread_name_prefix='analysis-job')
+
+
+def create_job(raw_csv, platform, col_names, upload_id, mapping, stages=None, market_source=None, api_budget=None):
+    """
+    Queue an analysis of a stored upload; any worker can pick the job up.
+
+    The job gets its own link to the uploaded file, which it parses itself using `mapping`
+    (the sniffed encoding and header row, the mapped fields and the discount). `stages` are
+    timings from the upload and mapping requests, kept in the job summary; `market_source`
+    picks the market data provider, the configured default when not given. `api_budget`
+    caps the eBay calls the job may make; None means no cap.
+    """
+    stages = dict(stages or {})
+    with metrics.stage('job_input_store', summary=stages):
+        source = artifacts.link(upload_id)
+    return AnalysisJob.objects.create(
+        raw_csv=raw_csv,
+        platform=platform,
+        options=json.dumps({
+            'col_names': col_names, 'mapping': mapping, 'market_source': get_provider(market_source).name,
+            'api_budget': api_budget,
+        }),
+        summary=json.dumps({'stages': stages}),
+        source=source,
+    )
+
+
+# Job id -> future of jobs this process has queued or is running
+_submitted = {}
+_submitted_lock = threading.Lock()
+
+
+def submit(job_id):
+    """Run the job on this process's pool; a job already queued or running here is not queued again."""
+    key = str(job_id)
+    with _submitted_lock:
+        future = _submitted.get(key)
+        if future is not None:
+            return future
+        future = _submitted[key] = _executor.submit(run_job, job_id)
+    future.add_done_callback(lambda done: _forget(key, done))
+    return future
+
+
+def _forget(key, future):
+    with _submitted_lock:
+        if _submitted.get(key) is future:
+            del _submitted[key]
+
+
+def _stale_cutoff():
+    return timezone.now() - timedelta(seconds=ANALYSIS_JOB_STALE_AFTER)
+
+
+def pending_job_ids():
+    """Queued jobs plus running jobs whose worker stopped sending heartbeats."""
+    return list(
+        AnalysisJob.objects.filter(Q(status='queued') | Q(status='running', heartbeat_at__lt=_stale_cutoff()))
+        .order_by('created_at')
+        .values_list('id', flat=True)
+    )
+
+
+def is_stale(job):
+    """
+    Whether a running job's worker stopped sending heartbeats.
+
+    Queued jobs are never stale: they may just be waiting for a free worker, and runjobs
+    picks up any whose process went away before starting them.
+    """
+    return job.status == 'running' and (job.heartbeat_at is None or job.heartbeat_at < _stale_cutoff())
+
+
+def claim(job_id):
+    # Atomic compare-and-set, so a job is never run by two workers at once
+    return AnalysisJob.objects.filter(id=job_id).filter(
+        Q(status='queued') | Q(status='running', heartbeat_at__lt=_stale_cutoff())
+    ).update(status='running', heartbeat_at=timezone.now()) == 1
+
+
+def _heartbeat(job_id, stop):
+    """Refresh the job's heartbeat every ANALYSIS_JOB_HEARTBEAT seconds until `stop` is set."""
+    try:
+        while not stop.wait(ANALYSIS_JOB_HEARTBEAT):
+            try:
+                AnalysisJob.objects.filter(id=job_id, status='running').update(heartbeat_at=timezone.now())
+            except Exception as e:
+                logger.warning(f"Heartbeat of analysis job {job_id} failed: {e}")
+    finally:
+        connection.close()
+
+
+def run_job(job_id):
+    if not claim(job_id):
+        return
+    # From a side thread, so a stage slowed by backoff, breaker pauses or resting keys
+    # never looks like a dead worker and gets the job taken over
+    stop = threading.Event()
+    beat = threading.Thread(target=_heartbeat, args=(job_id, stop), name=f'heartbeat-{job_id}', daemon=True)
+    beat.start()
+    try:
+        _run(AnalysisJob.objects.select_related('raw_csv').get(id=job_id))
+        metrics.inc('csvanalyzer_jobs_total', status='done')
+    except Exception as e:
+        logger.error(f"Analysis job {job_id} failed: {traceback.format_exc()}")
+        metrics.inc('csvanalyzer_jobs_total', status='failed')
+        AnalysisJob.objects.filter(id=job_id).update(status='failed', error_message=str(e), finished_at=timezone.now())
+    finally:
+        stop.set()
+        beat.join()
+        connection.close()
+
+
+def _run(job):
+    summary = {'rows_reused': 0, 'search_terms': 0, 'lookups_saved': 0, 'cache_hits': 0, 'api_calls': 0, 'coalesced': 0,
+               'failed_lookups': 0, 'requeued': 0, 'recovered': 0, 'api_budget': None, 'budget_spent': 0, 'skipped_lookups': 0}
+    summary.update(json.loads(job.summary))
+    stages = summary.setdefault('stages', {})
+    options = json.loads(job.options)
+    col_names = options.get('col_names')
+    mapping = options.get('mapping')
+    source = _market_source(job)
+    platform = job.platform
+    api_budget = options.get('api_budget')
+    summary['api_budget'] = api_budget
+
+    # The one full parse of the upload, and only of the columns that were mapped
+    with metrics.stage('job_input_parse', summary=stages) as parse:
+        if mapping:
+            items = ingest.load_items(
+                job.source, mapping['encoding'], mapping['header_row'], mapping['fields'], mapping['discount_percentage'],
+            )
+        else:
+            # Queued before uploads were parsed lazily: the source already holds the mapped rows
+            items = artifacts.read(job.source)
+        parse.rows = len(items)
+    with metrics.stage('job_diff', rows=len(items), summary=stages):
+        hashes = input_hashes(items, platform, col_names)
+        previous = _reusable_results(job, hashes)
+    # Each finished chunk is one Parquet part of an artifact named after the job
+    checkpoint = artifacts.open_writer(job.id)
+    results = artifacts.read_records(job.id)
+
+    if results:
+        logger.info(f"Resuming analysis job {job.id} at row {len(results)}/{len(items)}")
+    job.total = len(items)
+    job.processed = job.resumed_from = len(results)
+    job.errors = sum(1 for r in results if 'error' in r)
+    job.started_at = job.heartbeat_at = timezone.now()
+    job.save(update_fields=['total', 'processed', 'resumed_from', 'errors', 'started_at', 'heartbeat_at'])
+
+    market_memo = {}
+    # Trend columns per search term, read once its market data is in
+    trend_memo = {}
+    # Why each search term's lookup failed; those rows are flagged rather than priced at zero
+    failures = {}
+    # With a budget, only the terms it was planned for get an eBay call; the rest are skipped
+    funded = None
+    skipped = set()
+    # Search terms being retried after a failed lookup, and those the budget had no call left for
+    retrying = set()
+    unpaid = set()
+    if api_budget is not None and platform != 'walmart':
+        with metrics.stage('budget_plan', summary=stages) as planning:
+            pending = [i for i in range(len(results), len(items)) if hashes[i] not in previous]
+            planning.rows = len(pending)
+            funded = budget.plan(items.iloc[pending], platform, source, api_budget - summary['budget_spent'])
+        budget_lock = threading.Lock()
+
+        def spend():
+            # Charged per request sent to eBay, so retries and re-sends after a 401 count too
+            with budget_lock:
+                if summary['budget_spent'] >= api_budget:
+                    return False
+                summary['budget_spent'] += 1
+                return True
+
+        def refund():
+            with budget_lock:
+                summary['budget_spent'] -= 1
+    else:
+        spend = None
+
+    async def lookup(engine, search_term):
+        market_data = await engine.run(market_cache.get, search_term, source)
+        if market_data is not None:
+            summary['cache_hits'] += 1
+            return market_data
+        if funded is not None and (search_term not in funded or not spend()):
+            if search_term in retrying:
+                # A retry the budget can't pay for keeps the first lookup's failure
+                unpaid.add(search_term)
+            else:
+                skipped.add(search_term)
+                summary['skipped_lookups'] += 1
+            return None
+        try:
+            # A term another analysis is already fetching is waited on, not fetched again;
+            # only lookups that actually reach eBay spend rate-limit tokens
+            market_data, coalesced = await single_flight.run(
+                market_cache.cache_key(search_term, source),
+                lambda: engine.call(fetch_and_cache, search_term, source, spend, spend=spend),
+            )
+            summary['coalesced' if coalesced else 'api_calls'] += 1
+            if coalesced and funded is not None:
+                # Another analysis paid for this one
+                refund()
+            return market_data
+        except Exception as e:
+            logger.error(f"eBay fetch error for {search_term}: {e}")
+            summary['failed_lookups'] += 1
+            metrics.inc('csvanalyzer_errors_total', kind='market_lookup')
+            failures[search_term] = _failure_reason(e)
+            return None
+
+    def price(rows, market_data, search_terms):
+        computed = compute_metrics(rows, market_data, platform, col_names)
+        for row, term in zip(computed, search_terms):
+            if term in failures:
+                row['error'] = f"{LOOKUP_FAILED}: {failures[term]}"
+            elif term in skipped:
+                row['error'] = budget.BUDGET_SKIPPED
+            row.update(trend_memo.get(term, price_history.NO_TREND))
+        return computed
+
+    for start, end in _chunks(len(results), len(items)):
+        reused = [previous.get(h) for h in hashes[start:end]]
+        # Only rows that are new or changed since the last analysis go through the pipeline
+        chunk = items.iloc[start:end][[row is None for row in reused]]
+
+        # Stage 1: market data once per distinct search term, fanned back out to every row using it
+        with metrics.stage('market_lookup', rows=len(chunk), summary=stages):
+            if platform == 'walmart':
+                search_terms = market_data = [None] * len(chunk)
+            else:
+                search_terms = [search_term_for(item) for item in chunk.to_dict(orient='records')]
+                new_terms = list(dict.fromkeys(term for term in search_terms if term not in market_memo))
+                market_memo.update(zip(new_terms, FetchEngine().map(lookup, new_terms)))
+                market_data = [market_memo[term] for term in search_terms]
+                summary['search_terms'] += len(new_terms)
+                summary['lookups_saved'] += len(search_terms) - len(new_terms)
+        if platform != 'walmart':
+            # One grouped query per chunk, after its lookups have added their snapshots
+            with metrics.stage('price_trends', rows=len(new_terms), summary=stages):
+                trend_memo.update(price_history.trends(new_terms, source))
+
+        # Stage 2: all derived metrics for the chunk at once
+        with metrics.stage('pricing', rows=len(chunk), summary=stages):
+            computed = iter(price(chunk, market_data, search_terms))
+            chunk_results = [row if row is not None else next(computed) for row in reused]
+        summary['rows_reused'] += len(chunk_results) - len(chunk)
+        with metrics.stage('checkpoint', rows=len(chunk_results), summary=stages):
+            checkpoint.append(pd.DataFrame(chunk_results))
+
+        results.extend(chunk_results)
+        chunk_errors = sum(1 for r in chunk_results if 'error' in r)
+        if chunk_errors:
+            metrics.inc('csvanalyzer_errors_total', chunk_errors, kind='row')
+        job.processed = len(results)
+        job.errors += chunk_errors
+        job.summary = json.dumps(summary)
+        job.heartbeat_at = timezone.now()
+        job.save(update_fields=['processed', 'errors', 'summary', 'heartbeat_at'])
+
+    # Rows whose lookup failed get one more pass once the rest of the file is done
+    requeued = [i for i, row in enumerate(results) if str(row.get('error') or '').startswith(LOOKUP_FAILED)]
+    if requeued:
+        with metrics.stage('market_retry', rows=len(requeued), summary=stages):
+            rows = items.iloc[requeued]
+            search_terms = [search_term_for(item) for item in rows.to_dict(orient='records')]
+            retry_terms = list(dict.fromkeys(search_terms))
+            for term in retry_terms:
+                failures.pop(term, None)
+            retrying.update(retry_terms)
+            market_memo.update(zip(retry_terms, FetchEngine().map(lookup, retry_terms)))
+            trend_memo.update(price_history.trends(retry_terms, source))
+            retried = price(rows, [market_memo[term] for term in search_terms], search_terms)
+            for i, row, term in zip(requeued, retried, search_terms):
+                if term not in unpaid:
+                    results[i] = row
+        summary['requeued'] = len(requeued)
+        summary['recovered'] = sum(1 for i in requeued if 'error' not in results[i])
+        job.errors = sum(1 for r in results if 'error' in r)
+        logger.info(f"Analysis job {job.id}: {summary['recovered']}/{len(requeued)} re-queued rows recovered")
+
+    if skipped:
+        logger.info(f"Analysis job {job.id}: API budget of {api_budget} calls spent; {len(skipped)} search terms skipped")
+
+    _finish(job, results, hashes, summary)
+    logger.info(f"Analysis job {job.id} summary: {summary}")
+    logger.info(f"Market cache stats: {market_cache.stats()}")
+
+
+def _chunks(start, total):
+    """
+    (start, end) of each chunk from row `start` on.
+
+    Chunks start small and double up to ANALYSIS_JOB_CHUNK_SIZE, so the first rows are
+    checkpointed (and streamed to the browser) within a second or so of the job starting.
+    A chunk's size depends only on where it starts, so a resumed job picks up the same chunks.
+    """
+    while start < total:
+        end = min(total, start + min(ANALYSIS_JOB_CHUNK_SIZE, max(ANALYSIS_JOB_FIRST_CHUNK_SIZE, start)))
+        yield start, end
+        start = end
+
+
+def _reusable_results(job, hashes):
+    """
+    Rows of the file's last analysis whose input is unchanged, keyed by input hash.
+
+    Nothing is reused once that analysis is older than the market cache TTL, since its
+    market data would be stale by then. Rows whose lookup failed or was skipped for want of
+    API budget are always analysed again.
+    """
+    last = job.raw_csv.jobs.filter(platform=job.platform, status='done').exclude(id=job.id).order_by('-finished_at').first()
+    if not last or last.finished_at < timezone.now() - timedelta(seconds=market_cache.MARKET_CACHE_TTL):
+        return {}
+    if _market_source(last) != _market_source(job):
+        return {}
+    wanted = set(hashes)
+    rows = job.raw_csv.results.filter(platform=job.platform).exclude(input_hash='')
+    rows = rows.exclude(error__startswith=LOOKUP_FAILED).exclude(error=budget.BUDGET_SKIPPED)
+    return {row.input_hash: row.as_row() for row in rows.iterator() if row.input_hash in wanted}
+
+
+def _market_source(job):
+    """Which market data provider the job prices against ('active' or 'sold' listings)."""
+    return get_provider(json.loads(job.options).get('market_source')).name
+
+
+def _failure_reason(error):
+    response = getattr(error, 'response', None)
+    if response is not None:
+        return f"HTTP {response.status_code}"
+    return type(error).__name__
+
+
+def _finish(job, results, hashes, summary):
+    instance = job.raw_csv
+    with transaction.atomic():
+        with metrics.stage('result_write', rows=len(results), summary=summary['stages']):
+            # A re-run of the same file and platform replaces the previous results
+            instance.results.filter(platform=job.platform).delete()
+            AnalysisResult.objects.bulk_create(
+                (AnalysisResult.from_row(instance, job.platform, row, row_number, input_hash)
+                 for row_number, (row, input_hash) in enumerate(zip(results, hashes))),
+                batch_size=ANALYSIS_RESULT_BATCH_SIZE,
+            )
+        job.status = 'done'
+        job.finished_at = timezone.now()
+        job.summary = json.dumps(summary)
+        job.save(update_fields=['status', 'finished_at', 'summary', 'errors'])
+
+    artifacts.delete(job.source)
+    artifacts.delete(job.id)
+    evict_artifacts()
+    price_history.prune()
+
+
+_last_eviction = 0.0
+
+
+def evict_artifacts(force=False):
+    """Drop stale artifacts, at most once per ARTIFACT_EVICT_INTERVAL unless forced."""
+    global _last_eviction
+    if not force and time.time() - _last_eviction < ARTIFACT_EVICT_INTERVAL:
+        return 0
+    _last_eviction = time.time()
+    keep = set()
+    for job_id, source in AnalysisJob.objects.filter(status__in=['queued', 'running']).values_list('id', 'source'):
+        keep.update((str(job_id), source))
+    return artifacts.evict(keep=keep)
+
+
+def progress(job):
+    eta = None
+    if job.status == 'running' and job.started_at and job.processed > job.resumed_from:
+        elapsed = (timezone.now() - job.started_at).total_seconds()
+        rate = (job.processed - job.resumed_from) / elapsed if elapsed else 0
+        if rate:
+            eta = round((job.total - job.processed) / rate)
+    return {
+        'id': str(job.id),
+        'name': job.raw_csv.name,
+        'status': job.status,
+        'processed': job.processed,
+        'total': job.total,
+        'errors': job.errors,
+        'eta_seconds': eta,
+        'summary': json.loads(job.summary),
+        'error': job.error_message,
+    }
@@ -0,0 +1,217 @@
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import requests
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .ebay_auth import EBAY_SCOPE, EBAY_TOKEN_STORE, TokenManager
+from .fetch_engine import EBAY_RATE_BURST, EBAY_RATE_LIMIT, TokenBucket, retry_after
+from .models import Key
+
+logger = logging.getLogger(__name__)
+
+EBAY_KEY_THROTTLE_COOLDOWN = getattr(settings, 'EBAY_KEY_THROTTLE_COOLDOWN', 60)
+EBAY_KEY_POOL_REFRESH = getattr(settings, 'EBAY_KEY_POOL_REFRESH', 60)
+EBAY_KEY_USAGE_FLUSH = getattr(settings, 'EBAY_KEY_USAGE_FLUSH', 25)
+
+
+class NoKeyAvailable(RuntimeError):
+    pass
+
+
+class KeySlot:
+    """One approved Key in the pool: its tokens (one per OAuth scope), its rate-limit bucket and today's call count."""
+
+    def __init__(self, key, store_path, rate, burst):
+        self.id = key.id
+        self.credentials = (key.Client_Id, key.Client_Secret)
+        self.store_path = store_path
+        self._tokens = {}
+        self._tokens_lock = threading.Lock()
+        self.bucket = TokenBucket(rate, burst)
+        self.pending = 0
+        self.sync(key)
+
+    def sync(self, key):
+        """Take the limit, today's usage and any rest period from the Key row."""
+        self.daily_limit = key.daily_limit
+        self.used = (key.calls_today if key.usage_date == timezone.localdate() else 0) + self.pending
+        self.resting_until = key.disabled_until.timestamp() if key.disabled_until else 0.0
+
+    def tokens(self, scope=EBAY_SCOPE):
+        """The key's TokenManager for `scope`, created on first use."""
+        with self._tokens_lock:
+            if scope not in self._tokens:
+                self._tokens[scope] = TokenManager(self.credentials, self.store_path, scope=scope)
+            return self._tokens[scope]
+
+    @property
+    def remaining(self):
+        return max(0, self.daily_limit - self.used)
+
+
+class KeyPool:
+    """
+    Every approved Key, each with its own token and per-key rate limit.
+
+    acquire() hands out the ready key with the most of its daily quota left, so calls spread
+    across keys and adding a key in admin adds its whole quota and rate. A throttled key rests
+    for its Retry-After; a key eBay rejects is unapproved. Usage is written back to the Key rows
+    every few calls, so it shows in admin and is shared by every worker process.
+    """
+
+    def __init__(self, store_path=EBAY_TOKEN_STORE, rate=EBAY_RATE_LIMIT, burst=EBAY_RATE_BURST,
+                 refresh_interval=EBAY_KEY_POOL_REFRESH):
+        self.store_path = store_path
+        self.rate = rate
+        self.burst = burst
+        self.refresh_interval = refresh_interval
+        self._slots = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def _due(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at >= self.refresh_interval
+
+    def refresh(self, force=False):
+        """Reload approved keys from the database, at most once per refresh_interval unless forced."""
+        if not (force or self._due()):
+            return
+        with self._refresh_lock:
+            if not (force or self._due()):
+                return
+            self.flush()
+            slots = {}
+            for key in Key.objects.filter(Approved=True):
+                slot = self._slots.get(key.id)
+                if slot is None or slot.credentials != (key.Client_Id, key.Client_Secret):
+                    slot = KeySlot(key, self.store_path, self.rate, self.burst)
+                else:
+                    slot.sync(key)
+                slots[key.id] = slot
+            with self._lock:
+                self._slots = slots
+            self._loaded_at = time.monotonic()
+
+    def acquire(self):
+        """The key to make the next call with, once its rate limit allows; waits out resting keys."""
+        while True:
+            self.refresh()
+            with self._lock:
+                now = time.time()
+                slots = [s for s in self._slots.values() if s.remaining]
+                ready = [s for s in slots if s.resting_until <= now]
+                if ready:
+                    # Prefer a key that can go right away, then the one with the most quota left
+                    slot = max(ready, key=lambda s: (s.bucket.tokens() >= 1, s.remaining))
+                    slot.used += 1
+                    slot.pending += 1
+                    break
+            if not self._slots:
+                # A key may have just been approved in admin
+                self.refresh(force=True)
+                if not self._slots:
+                    raise NoKeyAvailable("No approved eBay API key configured")
+                continue
+            if not slots:
+                raise NoKeyAvailable("Every approved eBay API key has used its daily quota")
+            time.sleep(max(0.05, min(s.resting_until for s in slots) - now))
+
+        wait = slot.bucket._reserve()
+        if wait:
+            time.sleep(wait)
+        metrics.inc('csvanalyzer_ebay_key_calls_total', key=slot.id)
+        if slot.pending >= EBAY_KEY_USAGE_FLUSH:
+            self._flush(slot)
+        return slot
+
+    def token(self, slot, scope=EBAY_SCOPE):
+        try:
+            return slot.tokens(scope).get_token()
+        except requests.HTTPError as e:
+            self._rejected(slot, e)
+            raise
+
+    def invalidate(self, slot, token, scope=EBAY_SCOPE):
+        """A search got a 401 with `token`; mint a new one for the same key and scope."""
+        try:
+            return slot.tokens(scope).invalidate(token)
+        except requests.HTTPError as e:
+            self._rejected(slot, e)
+            raise
+
+    def raise_for_status(self, slot, response):
+        """response.raise_for_status(), resting the key first if eBay throttled it."""
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            if response.status_code == 429:
+                self._throttled(slot, e)
+            raise
+
+    def _others_ready(self, slot):
+        now = time.time()
+        return any(s is not slot and s.remaining and s.resting_until <= now for s in self._slots.values())
+
+    def _throttled(self, slot, error):
+        seconds = retry_after(error) or EBAY_KEY_THROTTLE_COOLDOWN
+        until = time.time() + seconds
+        with self._lock:
+            slot.resting_until = max(slot.resting_until, until)
+            # With another key ready the call moves on at once, instead of waiting out the 429
+            error.rotated = self._others_ready(slot)
+        Key.objects.filter(id=slot.id).update(
+            disabled_until=datetime.fromtimestamp(until, dt_timezone.utc), last_error="Throttled by eBay (HTTP 429)",
+        )
+        metrics.inc('csvanalyzer_ebay_key_events_total', key=slot.id, event='throttled')
+        logger.warning(f"eBay key {slot.id} throttled, resting it for {seconds:.0f}s")
+
+    def _rejected(self, slot, error):
+        status = error.response.status_code if error.response is not None else None
+        if status not in (400, 401):
+            return
+        with self._lock:
+            self._slots.pop(slot.id, None)
+            error.rotated = bool(self._slots)
+        self._flush(slot)
+        Key.objects.filter(id=slot.id).update(
+            Approved=False, last_error=f"Rejected by eBay (HTTP {status})",
+        )
+        metrics.inc('csvanalyzer_ebay_key_events_total', key=slot.id, event='revoked')
+        logger.error(f"eBay key {slot.id} was rejected (HTTP {status}); it has been unapproved")
+
+    def _flush(self, slot):
+        with self._lock:
+            n, slot.pending = slot.pending, 0
+        if not n:
+            return
+        today = timezone.localdate()
+        if not Key.objects.filter(id=slot.id, usage_date=today).update(calls_today=F('calls_today') + n):
+            Key.objects.filter(id=slot.id).update(usage_date=today, calls_today=n)
+
+    def flush(self):
+        """Write every key's unsaved usage to the database."""
+        for slot in list(self._slots.values()):
+            self._flush(slot)
+
+    def stats(self):
+        now = time.time()
+        return [
+            {
+                'key': slot.id,
+                'used': slot.used,
+                'remaining': slot.remaining,
+                'daily_limit': slot.daily_limit,
+                'resting_seconds': round(max(0.0, slot.resting_until - now), 1),
+            }
+            for slot in self._slots.values()
+        ]
+
+
+key_pool = KeyPool()
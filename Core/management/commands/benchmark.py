@@ -0,0 +1,226 @@
+import io, json, os, platform, random, resource, shutil, subprocess, sys, tempfile, threading, time
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client
+from django.test.utils import setup_test_environment
+from django.utils import timezone
+
+from Core import analysis, artifacts, ebay_auth, fetch_engine, key_pool, market_data
+from Core.ebay_stub import StubEbayServer
+from Core.models import Key
+
+CHILD_OPTIONS = ('distinct', 'latency', 'jitter', 'error_rate', 'throttle_rate', 'stub_rate_limit', 'rate', 'keys', 'source', 'budget', 'seed')
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class WriteTimer:
+    """Total time spent in INSERT/UPDATE/DELETE statements, on every thread's connection."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.statements = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() not in ('INSERT', 'UPDATE', 'DELETE'):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self._lock:
+                self.seconds += time.perf_counter() - started
+                self.statements += 1
+
+    def install(self, sender=None, connection=None, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark upload -> map_columns -> getData against a local stub eBay server and print "
+        "rows/sec, lookup latency, peak RSS and DB write time as JSON. Uses a throwaway database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help="Comma-separated sheet sizes (rows).")
+        parser.add_argument('--distinct', type=float, default=0.2, help="Distinct UPCs as a fraction of rows.")
+        parser.add_argument('--latency', type=float, default=0.05, help="Stub search latency in seconds.")
+        parser.add_argument('--jitter', type=float, default=0.02, help="Extra random stub latency, up to this many seconds.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of searches answered with a 500.")
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help="Fraction of searches answered with a 429.")
+        parser.add_argument('--stub-rate-limit', type=int, default=0, help="Requests/second per key the stub allows before 429s (0 = no limit).")
+        parser.add_argument('--rate', type=float, default=500, help="Client-side EBAY_RATE_LIMIT (per key) for the run.")
+        parser.add_argument('--keys', type=int, default=1, help="Approved API keys in the pool.")
+        parser.add_argument('--source', choices=sorted(market_data.PROVIDERS), default='active', help="Market data source to price against.")
+        parser.add_argument('--budget', type=int, default=0, help="API call budget for the analysis (0 = no budget).")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help="Also write the JSON report to this file.")
+        parser.add_argument('--child', action='store_true', help="Run a single size in this process (used internally).")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError("--sizes must be comma-separated integers")
+
+        if options['child']:
+            self.stdout.write(json.dumps(self._run(sizes[0], options)))
+            return
+
+        # One process per size, so peak RSS and in-process caches belong to that run alone
+        runs = []
+        for size in sizes:
+            self.stderr.write(f"Benchmarking {size} rows...")
+            command = [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'benchmark', '--child', '--sizes', str(size)]
+            for name in CHILD_OPTIONS:
+                command += ['--' + name.replace('_', '-'), str(options[name])]
+            completed = subprocess.run(command, capture_output=True, text=True)
+            if completed.returncode:
+                raise CommandError(f"Benchmark of {size} rows failed:\n{completed.stderr}")
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        report = {
+            'benchmark': 'analysis_pipeline',
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'config': {name: options[name] for name in CHILD_OPTIONS},
+            'runs': runs,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    def _sheet(self, rows, distinct, seed):
+        rng = random.Random(seed)
+        upcs = [str(100000000000 + rng.randrange(899999999999)) for _ in range(max(1, int(rows * distinct)))]
+        out = io.StringIO()
+        out.write("UPC,SKU,Title,Cost,Brand\n")
+        for i in range(rows):
+            upc = upcs[i % len(upcs)]
+            out.write(f"{upc},SKU-{i},Item {upc},\"${rng.uniform(1, 150):,.2f}\",Brand {i % 17}\n")
+        return out.getvalue().encode()
+
+    def _run(self, rows, options):
+        setup_test_environment()
+        workdir = tempfile.mkdtemp(prefix='csvanalyzer-bench-')
+        # A file, not SQLite's in-memory default, so the job worker threads share it
+        connection.settings_dict['TEST']['NAME'] = os.path.join(workdir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        stub = StubEbayServer(
+            latency=options['latency'], jitter=options['jitter'], error_rate=options['error_rate'],
+            throttle_rate=options['throttle_rate'], rate_limit=options['stub_rate_limit'], seed=options['seed'],
+        ).start()
+        timer = WriteTimer()
+        lookup_seconds = []
+        fetch = analysis.fetch_ebay_market_data
+
+        def timed_fetch(*args):
+            started = time.perf_counter()
+            try:
+                return fetch(*args)
+            finally:
+                lookup_seconds.append(time.perf_counter() - started)
+
+        try:
+            # Point everything the pipeline touches at the stub and the scratch directory
+            market_data.PROVIDERS['active'].url = stub.search_url
+            market_data.PROVIDERS['sold'].url = stub.sales_url
+            analysis.fetch_ebay_market_data = timed_fetch
+            ebay_auth.EBAY_OAUTH_URL = stub.oauth_url
+            key_pool.key_pool.store_path = os.path.join(workdir, 'token.json')
+            artifacts.ARTIFACT_DIR = os.path.join(workdir, 'artifacts')
+            key_pool.key_pool.rate = key_pool.key_pool.burst = float(options['rate'])
+            limiter = fetch_engine.rate_limiter
+            limiter.rate = limiter._tokens = limiter.capacity = float(options['rate'] * options['keys'])
+            for i in range(options['keys']):
+                Key.objects.create(Client_Id=f'benchmark-{i}', Client_Secret='benchmark', Approved=True, daily_limit=10 ** 9)
+
+            connection_created.connect(timer.install)
+            timer.install(connection=connection)
+            return self._flow(rows, options, stub, timer, lookup_seconds)
+        finally:
+            connection_created.disconnect(timer.install)
+            analysis.fetch_ebay_market_data = fetch
+            stub.stop()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _flow(self, rows, options, stub, timer, lookup_seconds):
+        name = f'benchmark-{rows}.csv'
+        sheet = self._sheet(rows, options['distinct'], options['seed'])
+        client = Client()
+
+        started = time.perf_counter()
+        response = client.post('/', {'file': SimpleUploadedFile(name, sheet, content_type='text/csv')})
+        if response.status_code != 200:
+            raise CommandError(f"Upload failed: {response.content[:500]}")
+        uploaded = time.perf_counter()
+
+        response = client.post('/', {
+            'map_action': 'map_columns', 'upc_col': 'upc', 'sku_col': 'sku', 'title_col': 'title',
+            'cost_col': 'cost', 'dis_col': '0', 'optional_1': 'brand', 'platform': 'ebay', 'market_source': options['source'],
+            'api_budget': options['budget'] or '',
+        })
+        if response.status_code != 200:
+            raise CommandError(f"map_columns failed: {response.content[:500]}")
+        job = response.json()['job']
+        mapped = time.perf_counter()
+
+        while job['status'] not in ('done', 'failed'):
+            time.sleep(0.05)
+            job = client.get(f"/jobs/{job['id']}").json()
+        if job['status'] == 'failed':
+            raise CommandError(f"Analysis job failed: {job['error']}")
+        analysed = time.perf_counter()
+
+        fetched_rows = fetched_bytes = 0
+        page, pages = 1, 1
+        while page <= pages:
+            response = client.get('/analyze/data', {'name': name, 'platform': 'Ebay', 'limit': 500, 'page': page})
+            body = b''.join(response.streaming_content)
+            data = json.loads(body)
+            fetched_rows += len(data['results'])
+            fetched_bytes += len(body)
+            page, pages = page + 1, data['pages']
+        finished = time.perf_counter()
+
+        elapsed = finished - started
+        return {
+            'rows': rows,
+            'distinct_terms': max(1, int(rows * options['distinct'])),
+            'rows_per_sec': round(rows / (analysed - started), 1),
+            'seconds': {
+                'upload': round(uploaded - started, 3),
+                'map_columns': round(mapped - uploaded, 3),
+                'analysis': round(analysed - mapped, 3),
+                'get_data': round(finished - analysed, 3),
+                'total': round(elapsed, 3),
+            },
+            'lookup_latency_ms': {
+                'count': len(lookup_seconds),
+                'p50': round(_percentile(lookup_seconds, 50) * 1000, 2) if lookup_seconds else None,
+                'p99': round(_percentile(lookup_seconds, 99) * 1000, 2) if lookup_seconds else None,
+            },
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            'db_write_seconds': round(timer.seconds, 3),
+            'db_write_statements': timer.statements,
+            'get_data': {'rows': fetched_rows, 'bytes': fetched_bytes},
+            'job': {'errors': job['errors'], 'summary': job['summary']},
+            'stub': dict(stub.counts),
+            'keys': key_pool.key_pool.stats(),
+        }
@@ -0,0 +1,54 @@
+import random, time
+
+import pandas as pd
+from django.core.management.base import BaseCommand, CommandError
+
+from Core.analysis import process_item
+from Core.market_data import EMPTY_MARKET_DATA
+from Core.pricing import compute_metrics
+
+
+class Command(BaseCommand):
+    help = "Compare per-row process_item() with the vectorized compute_metrics() on synthetic rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--platform', default='ebay', choices=['ebay', 'walmart'])
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rows, platform = options['rows'], options['platform']
+        rng = random.Random(options['seed'])
+        col_names = {'optional_name_1': 'brand', 'optional_name_2': '', 'optional_name_3': ''}
+
+        items = pd.DataFrame({
+            'UPC': [str(rng.randrange(10 ** 11, 10 ** 12)) for _ in range(rows)],
+            'SKU': [f'SKU-{i}' for i in range(rows)],
+            'Title': [f'Item {i}' for i in range(rows)],
+            'Cost': [round(rng.uniform(0, 200), 2) for _ in range(rows)],
+            'ActualPrice': [round(rng.uniform(0, 250), 2) for _ in range(rows)],
+            'brand': [rng.choice(['Acme', 'Globex', 'Initech']) for _ in range(rows)],
+        })
+        market_data = [
+            EMPTY_MARKET_DATA if rng.random() < 0.05 else
+            (round(rng.uniform(0, 400), 2), round(rng.uniform(0, 20), 2), rng.randrange(0, 50), f'https://example.com/{i}')
+            for i in range(rows)
+        ]
+
+        records = items.to_dict(orient='records')
+        started = time.perf_counter()
+        expected = [process_item(item, platform, col_names, market) for item, market in zip(records, market_data)]
+        per_row = time.perf_counter() - started
+
+        started = time.perf_counter()
+        actual = compute_metrics(items, market_data, platform, col_names)
+        vectorized = time.perf_counter() - started
+
+        mismatches = sum(1 for a, b in zip(expected, actual) if a != b)
+        if mismatches or len(expected) != len(actual):
+            raise CommandError(f"{mismatches} of {rows} rows differ between process_item and compute_metrics")
+
+        self.stdout.write(f"rows:        {rows}")
+        self.stdout.write(f"per-row:     {per_row:.3f}s")
+        self.stdout.write(f"vectorized:  {vectorized:.3f}s")
+        self.stdout.write(self.style.SUCCESS(f"speedup:     {per_row / vectorized:.1f}x, outputs identical"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from Core import jobs
+
+
+class Command(BaseCommand):
+    help = "Delete stored uploads and job data older than ARTIFACT_TTL. Meant to be run from cron."
+
+    def handle(self, *args, **options):
+        evicted = jobs.evict_artifacts(force=True)
+        self.stdout.write(f"Evicted {evicted} artifact(s)")
@@ -0,0 +1,331 @@
+import argparse, io, json, os, random, shutil, socket, subprocess, sys, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import orjson
+import requests
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+
+from Core import artifacts, ebay_auth, fetch_engine, key_pool, market_cache, market_data
+from Core.ebay_stub import StubEbayServer
+from Core.management.commands.benchmark import _percentile
+from Core.models import Key, MarketData
+
+SERVERS = ('wsgi', 'asgi')
+
+
+class PooledWSGIServer(WSGIServer):
+    """wsgiref's server with a fixed pool of worker threads, like gunicorn's gthread worker."""
+
+    request_queue_size = 2048
+
+    def __init__(self, address, threads):
+        super().__init__(address, _QuietHandler)
+        self._pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi-worker')
+
+    def process_request(self, request, client_address):
+        # Accepted connections wait for a free worker, as they would behind a real WSGI server
+        self._pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _use_database(path):
+    settings.DATABASES['default']['NAME'] = path
+    connections['default'].settings_dict['NAME'] = path
+    connections['default'].close()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _sheet(rows, distinct, seed, first_upc=100000000000):
+    rng = random.Random(seed)
+    upcs = [str(first_upc + i) for i in range(max(1, int(rows * distinct)))]
+    out = io.StringIO()
+    out.write("UPC,SKU,Title,Cost\n")
+    for i in range(rows):
+        upc = upcs[i % len(upcs)]
+        out.write(f"{upc},SKU-{i},Item {upc},{rng.uniform(1, 150):.2f}\n")
+    return out.getvalue().encode(), upcs
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare how many concurrent users one WSGI process (a fixed pool of worker threads) and one "
+        "ASGI process (uvicorn) serve while a long analysis runs, against a local stub eBay server. "
+        "Each simulated user follows the analysis over its event stream and keeps loading the file "
+        "list, job status, a results page and the home page. Uses a throwaway database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', default='wsgi,asgi', help="Comma-separated servers to test: wsgi, asgi.")
+        parser.add_argument('--users', default='5,10,25,50,100,200', help="Comma-separated concurrent user counts.")
+        parser.add_argument('--duration', type=float, default=15, help="Seconds each user count is held for.")
+        parser.add_argument('--threads', type=int, default=8, help="Worker threads of the WSGI server.")
+        parser.add_argument('--think', type=float, default=0.5, help="Seconds a user waits between page loads.")
+        parser.add_argument('--no-stream', action='store_true', help="Users poll job status instead of holding an event stream.")
+        parser.add_argument('--timeout', type=float, default=10, help="Seconds before a request counts as failed.")
+        parser.add_argument('--slo', type=float, default=1.0, help="p95 latency (seconds) a user count must stay under to count as served.")
+        parser.add_argument('--rows', type=int, default=20000, help="Rows of the analysis kept running during the test.")
+        parser.add_argument('--latency', type=float, default=0.05, help="Stub search latency in seconds.")
+        parser.add_argument('--rate', type=float, default=25, help="Client-side EBAY_RATE_LIMIT for the server.")
+        parser.add_argument('--output', help="Also write the JSON report to this file.")
+        # Used internally to start the server under test in its own process
+        parser.add_argument('--serve', choices=SERVERS, help=argparse.SUPPRESS)
+        parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+        parser.add_argument('--workdir', help=argparse.SUPPRESS)
+        parser.add_argument('--stub-url', help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['serve']:
+            return self._serve(options)
+        servers = [s.strip() for s in options['servers'].split(',') if s.strip()]
+        if set(servers) - set(SERVERS):
+            raise CommandError(f"--servers must be among: {', '.join(SERVERS)}")
+        try:
+            user_counts = [int(n) for n in options['users'].split(',') if n.strip()]
+        except ValueError:
+            raise CommandError("--users must be comma-separated integers")
+
+        workdir = tempfile.mkdtemp(prefix='csvanalyzer-load-')
+        stub = StubEbayServer(latency=options['latency']).start()
+        try:
+            template = self._template_db(workdir)
+            runs = {}
+            for server in servers:
+                self.stderr.write(f"Load testing {server}...")
+                runs[server] = self._test_server(server, template, workdir, stub, user_counts, options)
+        finally:
+            stub.stop()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        report = {
+            'benchmark': 'concurrent_users',
+            'created_at': timezone.now().isoformat(),
+            'config': {name: options[name] for name in (
+                'users', 'duration', 'threads', 'think', 'no_stream', 'timeout', 'slo', 'rows', 'latency', 'rate')},
+            # The most users each server kept under the latency target with no failed requests
+            'capacity': {server: max((r['users'] for r in levels if r['served']), default=0) for server, levels in runs.items()},
+            'runs': runs,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
+
+    def _template_db(self, workdir):
+        """A migrated database with an API key and cached market data for the seed file; copied per server."""
+        path = os.path.join(workdir, 'template.sqlite3')
+        _use_database(path)
+        call_command('migrate', verbosity=0, interactive=False)
+        Key.objects.create(Client_Id='loadtest', Client_Secret='loadtest', Approved=True, daily_limit=10 ** 9)
+        _, upcs = _sheet(500, 1.0, 0, first_upc=900000000000)
+        provider = market_data.get_provider('active')
+        MarketData.objects.bulk_create(
+            MarketData(search_term=market_cache.cache_key(upc), **dict(zip(
+                ('avg_price', 'avg_shipping', 'volume', 'link'),
+                provider.parse(orjson.dumps({'itemSummaries': StubEbayServer.listings(upc)})),
+            )))
+            for upc in upcs
+        )
+        connections['default'].close()
+        return path
+
+    def _test_server(self, server, template, workdir, stub, user_counts, options):
+        database = os.path.join(workdir, f'{server}.sqlite3')
+        shutil.copy(template, database)
+        port = _free_port()
+        log = open(os.path.join(workdir, f'{server}.log'), 'w+')
+        process = subprocess.Popen(
+            [sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'loadtest', '--serve', server,
+             '--port', str(port), '--workdir', workdir, '--stub-url', stub.base_url,
+             '--threads', str(options['threads']), '--rate', str(options['rate'])],
+            stdout=log, stderr=subprocess.STDOUT,
+        )
+        base = f'http://127.0.0.1:{port}/'
+        try:
+            self._wait_until_up(base, process, log)
+            # A finished analysis for the results page, then one that runs for the whole test
+            self._analyse(base, 'seed.csv', _sheet(500, 1.0, 0, first_upc=900000000000)[0], wait=True)
+            job = self._analyse(base, 'long.csv', _sheet(options['rows'], 0.5, 1)[0], wait=False)
+            levels = []
+            for users in user_counts:
+                self.stderr.write(f"  {users} users")
+                level = self._load(base, job['id'], users, options)
+                levels.append(level)
+                if not level['served'] and level['error_rate'] > 0.5:
+                    # Past the breaking point; higher counts would only fail harder
+                    break
+            return levels
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+            log.close()
+
+    def _wait_until_up(self, base, process, log):
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                log.seek(0)
+                raise CommandError(f"Server exited:\n{log.read()[-2000:]}")
+            try:
+                requests.get(base, params={'id': 'home'}, timeout=2).raise_for_status()
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise CommandError("Server did not start within 60s")
+
+    def _analyse(self, base, name, sheet, wait):
+        session = requests.Session()
+        response = session.post(base, files={'file': (name, sheet, 'text/csv')}, timeout=120)
+        if response.status_code != 200:
+            raise CommandError(f"Upload failed: {response.text[:500]}")
+        response = session.post(base, data={
+            'map_action': 'map_columns', 'upc_col': 'upc', 'sku_col': 'sku', 'title_col': 'title',
+            'cost_col': 'cost', 'dis_col': '0', 'platform': 'ebay',
+        }, timeout=120)
+        if response.status_code != 200:
+            raise CommandError(f"map_columns failed: {response.text[:500]}")
+        job = response.json()['job']
+        while wait and job['status'] not in ('done', 'failed'):
+            time.sleep(0.2)
+            job = session.get(f"{base}jobs/{job['id']}", timeout=30).json()
+        if job['status'] == 'failed':
+            raise CommandError(f"Analysis failed: {job['error']}")
+        return job
+
+    def _load(self, base, job_id, users, options):
+        stop = threading.Event()
+        lock = threading.Lock()
+        latencies, failures, streams, responses = [], [], [], []
+        paths = [
+            ('', {'id': 'home'}),
+            (f'jobs/{job_id}', {}),
+            ('analyze/data', {'name': 'seed.csv', 'platform': 'Ebay', 'limit': 50}),
+            ('', {}),
+        ]
+
+        def user(i):
+            session = requests.Session()
+            rng = random.Random(i)
+            while not stop.is_set():
+                for path, params in paths:
+                    if 'name' in params:
+                        params = dict(params, page=rng.randint(1, 10))
+                    started = time.perf_counter()
+                    try:
+                        response = session.get(base + path, params=params, timeout=options['timeout'])
+                        ok = response.status_code == 200
+                    except requests.RequestException:
+                        ok = False
+                    with lock:
+                        (latencies if ok else failures).append(time.perf_counter() - started)
+                    if stop.wait(options['think']):
+                        return
+
+        def follow(i):
+            # The home page's EventSource on the running job; time to its first frame
+            started = time.perf_counter()
+            try:
+                with requests.get(f'{base}jobs/{job_id}/stream', stream=True, timeout=options['timeout']) as response:
+                    with lock:
+                        if stop.is_set():
+                            return
+                        responses.append(response)
+                    lines = response.iter_lines()
+                    next(lines)
+                    with lock:
+                        streams.append(time.perf_counter() - started)
+                    for _ in lines:
+                        pass
+            except Exception:
+                # A stream that never opened, or one closed below at the end of the run
+                pass
+
+        threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(users)]
+        if not options['no_stream']:
+            threads += [threading.Thread(target=follow, args=(i,), daemon=True) for i in range(users)]
+        for thread in threads:
+            thread.start()
+        time.sleep(options['duration'])
+        stop.set()
+        with lock:
+            # Hang up on the open streams, so they do not hold on to the server during the next count
+            for response in responses:
+                response.close()
+        for thread in threads:
+            thread.join(timeout=options['timeout'])
+
+        requests_made = len(latencies) + len(failures)
+        opened = streams[:users]
+        p95 = _percentile(latencies, 95)
+        level = {
+            'users': users,
+            'requests': requests_made,
+            'requests_per_sec': round(len(latencies) / options['duration'], 1),
+            'failed': len(failures),
+            'error_rate': round(len(failures) / requests_made, 3) if requests_made else 1.0,
+            'latency_ms': {
+                'p50': round(_percentile(latencies, 50) * 1000, 1) if latencies else None,
+                'p95': round(p95 * 1000, 1) if latencies else None,
+                'p99': round(_percentile(latencies, 99) * 1000, 1) if latencies else None,
+            },
+        }
+        if not options['no_stream']:
+            level['streams'] = {
+                'opened': len(opened),
+                'failed': users - len(opened),
+                'first_frame_p95_ms': round(_percentile(opened, 95) * 1000, 1) if opened else None,
+            }
+        level['served'] = bool(
+            latencies and not failures and p95 <= options['slo'] and (options['no_stream'] or len(opened) == users)
+        )
+        return level
+
+    def _serve(self, options):
+        """Run the app on --port under the chosen server, pointed at the stub and the scratch directory."""
+        workdir = options['workdir']
+        _use_database(os.path.join(workdir, f"{options['serve']}.sqlite3"))
+        stub = options['stub_url']
+        market_data.PROVIDERS['active'].url = stub + '/buy/browse/v1/item_summary/search'
+        market_data.PROVIDERS['sold'].url = stub + '/buy/marketplace_insights/v1_beta/item_sales/search'
+        ebay_auth.EBAY_OAUTH_URL = stub + '/identity/v1/oauth2/token'
+        key_pool.key_pool.store_path = os.path.join(workdir, f"{options['serve']}-token.json")
+        key_pool.key_pool.rate = key_pool.key_pool.burst = float(options['rate'])
+        limiter = fetch_engine.rate_limiter
+        limiter.rate = limiter._tokens = limiter.capacity = float(options['rate'])
+        artifacts.ARTIFACT_DIR = os.path.join(workdir, f"{options['serve']}-artifacts")
+
+        if options['serve'] == 'asgi':
+            try:
+                import uvicorn
+            except ImportError:
+                raise CommandError("The ASGI server needs uvicorn (pip install uvicorn)")
+            from django.core.asgi import get_asgi_application
+            uvicorn.run(get_asgi_application(), host='127.0.0.1', port=options['port'], log_level='warning',
+                        lifespan='off', backlog=2048)
+        else:
+            from django.core.wsgi import get_wsgi_application
+            server = PooledWSGIServer(('127.0.0.1', options['port']), options['threads'])
+            server.set_app(get_wsgi_application())
+            server.serve_forever()
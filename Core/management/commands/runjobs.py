@@ -0,0 +1,25 @@
+import time
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+
+from Core import jobs
+
+
+class Command(BaseCommand):
+    help = "Run queued analysis jobs and resume running ones whose worker stopped responding."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--interval', type=float, default=5.0, help="Seconds between queue polls.")
+
+    def handle(self, *args, **options):
+        while True:
+            job_ids = jobs.pending_job_ids()
+            if job_ids:
+                self.stdout.write(f"Running {len(job_ids)} analysis job(s)")
+                wait([jobs.submit(job_id) for job_id in job_ids])
+            jobs.evict_artifacts()
+            if options['once']:
+                break
+            time.sleep(options['interval'])
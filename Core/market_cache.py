@@ -0,0 +1,121 @@
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import MarketData
+
+logger = logging.getLogger(__name__)
+
+MARKET_CACHE_TTL = getattr(settings, 'MARKET_CACHE_TTL', 60 * 60 * 24)
+MARKET_CACHE_MAX_ENTRIES = getattr(settings, 'MARKET_CACHE_MAX_ENTRIES', 200000)
+MARKET_CACHE_CULL_FREQUENCY = getattr(settings, 'MARKET_CACHE_CULL_FREQUENCY', 3)
+MARKET_CACHE_CULL_EVERY = getattr(settings, 'MARKET_CACHE_CULL_EVERY', 500)
+
+# Process-wide counters, reset only on restart
+_stats = {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0, 'evictions': 0}
+_stats_lock = threading.Lock()
+# Stores since the size limit was last checked
+_stores_since_cull = 0
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def normalize_term(search_term):
+    """Cache key for a UPC or title: trimmed, lower-cased, single-spaced."""
+    return ' '.join(str(search_term).split()).lower()[:255]
+
+
+def cache_key(search_term, source='active'):
+    """Entries are per market data source; active listings keep the plain term as their key."""
+    key = normalize_term(search_term)
+    return key if source == 'active' else f'{source}:{key}'[:255]
+
+
+def cache_keys(search_terms, source='active'):
+    """cache_key() -> the search terms that map to it; different spellings of a term share a key."""
+    keys = {}
+    for term in search_terms:
+        keys.setdefault(cache_key(term, source), []).append(term)
+    return keys
+
+
+def get(search_term, source='active'):
+    """Return (avg_price, avg_shipping, volume, link) or None on miss/expiry."""
+    key = cache_key(search_term, source)
+    entry = MarketData.objects.filter(search_term=key).first()
+    if entry is None:
+        _count('misses')
+        return None
+    if entry.fetched_at < timezone.now() - timedelta(seconds=MARKET_CACHE_TTL):
+        _count('expired')
+        _count('misses')
+        return None
+    _count('hits')
+    return entry.avg_price, entry.avg_shipping, entry.volume, entry.link
+
+
+def fresh_terms(search_terms, source='active', batch_size=500):
+    """The search terms that have a fresh entry, looked up a batch at a time."""
+    cutoff = timezone.now() - timedelta(seconds=MARKET_CACHE_TTL)
+    keys = cache_keys(search_terms, source)
+    found = []
+    batch = list(keys)
+    for start in range(0, len(batch), batch_size):
+        found += MarketData.objects.filter(
+            search_term__in=batch[start:start + batch_size], fetched_at__gte=cutoff,
+        ).values_list('search_term', flat=True)
+    return {term for key in found for term in keys[key]}
+
+
+def set(search_term, avg_price, avg_shipping, volume, link, source='active'):
+    key = cache_key(search_term, source)
+    MarketData.objects.update_or_create(
+        search_term=key,
+        defaults={
+            'avg_price': avg_price,
+            'avg_shipping': avg_shipping,
+            'volume': volume,
+            'link': link,
+            'fetched_at': timezone.now(),
+        },
+    )
+    _count('stores')
+    if _cull_due():
+        _cull()
+
+
+def _cull_due():
+    """True once every MARKET_CACHE_CULL_EVERY stores, so a store doesn't pay for a COUNT(*)."""
+    global _stores_since_cull
+    with _stats_lock:
+        _stores_since_cull += 1
+        if _stores_since_cull < MARKET_CACHE_CULL_EVERY:
+            return False
+        _stores_since_cull = 0
+        return True
+
+
+def _cull():
+    """Drop expired entries, then the oldest 1/CULL_FREQUENCY once over the size limit."""
+    if MarketData.objects.count() <= MARKET_CACHE_MAX_ENTRIES:
+        return
+    cutoff = timezone.now() - timedelta(seconds=MARKET_CACHE_TTL)
+    deleted, _ = MarketData.objects.filter(fetched_at__lt=cutoff).delete()
+    num = MarketData.objects.count()
+    if num > MARKET_CACHE_MAX_ENTRIES:
+        oldest = MarketData.objects.order_by('fetched_at').values_list('id', flat=True)[:num // MARKET_CACHE_CULL_FREQUENCY]
+        extra, _ = MarketData.objects.filter(id__in=list(oldest)).delete()
+        deleted += extra
+    _count('evictions', deleted)
+    logger.info(f"Market cache culled {deleted} entries")
+
+
+def stats():
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,112 @@
+import orjson
+from django.conf import settings
+
+from . import http_client
+from .ebay_auth import EBAY_INSIGHTS_SCOPE, EBAY_SCOPE
+from .key_pool import key_pool
+
+EBAY_SEARCH_URL = getattr(settings, 'EBAY_SEARCH_URL', 'https://api.ebay.com/buy/browse/v1/item_summary/search')
+EBAY_SOLD_SEARCH_URL = getattr(
+    settings, 'EBAY_SOLD_SEARCH_URL', 'https://api.ebay.com/buy/marketplace_insights/v1_beta/item_sales/search'
+)
+MARKET_DATA_SOURCE = getattr(settings, 'MARKET_DATA_SOURCE', 'active')
+
+EMPTY_MARKET_DATA = (0.0, 0.0, 0, '#')
+
+
+class MarketDataProvider:
+    """
+    Market data for a search term from a single eBay call: (avg_price, avg_shipping, volume, link).
+
+    Subclasses name the endpoint, the query and where the price and volume live in each
+    result; everything else (key pool, token refresh, parsing) is shared.
+    """
+
+    name = None
+    url = None
+    # OAuth scope the endpoint's token must carry
+    scope = EBAY_SCOPE
+    results_key = None
+    price_key = None
+    limit = 10
+    filter = 'conditionIds:{1000|3000|4000|5000},price:[5..1000]'
+
+    def params(self, search_term):
+        # MATCHING_ITEMS is the smallest response eBay offers; there is no per-field selection
+        return {'q': search_term, 'limit': self.limit, 'filter': self.filter, 'fieldgroups': 'MATCHING_ITEMS'}
+
+    def fetch(self, search_term, spend=None):
+        """`spend()`, when given, must return True before a search is re-sent after a 401."""
+        # Each call goes out on whichever approved key has the most quota left
+        key = key_pool.acquire()
+        token = key_pool.token(key, self.scope)
+        params = self.params(search_term)
+        response = http_client.get(self.url, headers={'Authorization': f'Bearer {token}'}, params=params)
+        if response.status_code == 401 and (spend is None or spend()):
+            token = key_pool.invalidate(key, token, self.scope)
+            response = http_client.get(self.url, headers={'Authorization': f'Bearer {token}'}, params=params)
+        key_pool.raise_for_status(key, response)
+        return self.parse(response.content)
+
+    def quantity(self, item):
+        return 1
+
+    def parse(self, body):
+        """Aggregate the raw response body in one pass over its results."""
+        items = orjson.loads(body).get(self.results_key)
+        if not items:
+            return EMPTY_MARKET_DATA
+        price_total = shipping_total = 0.0
+        priced = volume = 0
+        for item in items:
+            price = item.get(self.price_key)
+            if price:
+                price_total += float(price['value'])
+                priced += 1
+            # Results without a shipping quote count as free shipping
+            options = item.get('shippingOptions')
+            if options:
+                shipping_total += float(options[0].get('shippingCost', {}).get('value', 0.0))
+            volume += self.quantity(item)
+        if not priced:
+            return EMPTY_MARKET_DATA
+        return price_total / priced, shipping_total / len(items), volume, items[0].get('itemWebUrl', '#')
+
+
+class ActiveListings(MarketDataProvider):
+    """Current listings from the Browse API."""
+
+    name = 'active'
+    url = EBAY_SEARCH_URL
+    results_key = 'itemSummaries'
+    price_key = 'price'
+
+
+class SoldListings(MarketDataProvider):
+    """
+    Sales over the last 90 days from the Marketplace Insights API; volume is units sold.
+
+    The API is limited release: a key's application must be granted its scope by eBay,
+    or every search is refused with a 403.
+    """
+
+    name = 'sold'
+    url = EBAY_SOLD_SEARCH_URL
+    scope = EBAY_INSIGHTS_SCOPE
+    results_key = 'itemSales'
+    price_key = 'lastSoldPrice'
+    limit = 50
+
+    def quantity(self, item):
+        return int(item.get('totalSoldQuantity') or 1)
+
+
+PROVIDERS = {provider.name: provider for provider in (ActiveListings(), SoldListings())}
+
+
+def get_provider(name=None):
+    """The provider called `name`, or the configured default."""
+    try:
+        return PROVIDERS[name or MARKET_DATA_SOURCE]
+    except KeyError:
+        raise ValueError(f"Unknown market data source: {name}")
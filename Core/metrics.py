@@ -0,0 +1,120 @@
+import bisect, threading, time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HELP = {
+    'csvanalyzer_stage_seconds': ('histogram', "Time spent in each analysis pipeline stage."),
+    'csvanalyzer_stage_rows_total': ('counter', "Rows handled by each analysis pipeline stage."),
+    'csvanalyzer_ebay_request_seconds': ('histogram', "eBay API request latency."),
+    'csvanalyzer_ebay_responses_total': ('counter', "eBay API responses by endpoint and status code."),
+    'csvanalyzer_ebay_key_calls_total': ('counter', "eBay calls made by this process, by API key."),
+    'csvanalyzer_ebay_key_events_total': ('counter', "API keys taken out of rotation, by key and reason."),
+    'csvanalyzer_lookups_coalesced_total': ('counter', "Market lookups that waited on an identical lookup already in flight."),
+    'csvanalyzer_lookups_in_flight': ('gauge', "Market lookups in flight in this process."),
+    'csvanalyzer_ebay_retries_total': ('counter', "eBay calls retried after a retryable failure."),
+    'csvanalyzer_breaker_opened_total': ('counter', "Times eBay calls were paused by the circuit breaker."),
+    'csvanalyzer_errors_total': ('counter', "Errors by kind."),
+    'csvanalyzer_jobs_total': ('counter', "Analysis jobs finished by this process, by outcome."),
+    'csvanalyzer_market_cache_total': ('counter', "Market data cache events in this process."),
+    'csvanalyzer_results_requests_total': ('counter', "Results page requests, by outcome."),
+    'csvanalyzer_exports_total': ('counter', "Result exports started, by format."),
+    'csvanalyzer_jobs': ('gauge', "Analysis jobs in the database, by status."),
+    'csvanalyzer_ebay_key_calls_today': ('gauge', "eBay calls made today, by approved API key."),
+    'csvanalyzer_ebay_key_daily_limit': ('gauge', "Daily eBay call quota, by approved API key."),
+}
+
+_counters = {}
+_histograms = {}
+_lock = threading.Lock()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, n=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def observe(name, seconds, **labels):
+    key = _key(name, labels)
+    with _lock:
+        counts, total = _histograms.get(key, ([0] * (len(BUCKETS) + 1), 0.0))
+        counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        _histograms[key] = counts, total + seconds
+
+
+class Stage:
+    """What stage() yields; set `rows` when the row count is only known at the end."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.seconds = 0.0
+
+
+@contextmanager
+def stage(name, rows=0, summary=None):
+    """
+    Time a pipeline stage into the stage histogram and row counter.
+
+    With `summary` (a job's stage dict) the seconds and rows are added to it as well,
+    accumulating across calls such as one per chunk.
+    """
+    current = Stage(rows)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - started
+        observe('csvanalyzer_stage_seconds', current.seconds, stage=name)
+        if current.rows:
+            inc('csvanalyzer_stage_rows_total', current.rows, stage=name)
+        if summary is not None:
+            totals = summary.setdefault(name, {'seconds': 0.0, 'rows': 0})
+            totals['seconds'] = round(totals['seconds'] + current.seconds, 4)
+            totals['rows'] += current.rows
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render(extra_counters=()):
+    """
+    Everything recorded in this process, in the Prometheus text exposition format.
+
+    `extra_counters` are (name, labels, value) tuples gathered at scrape time, e.g. gauges.
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(counts), total) for key, (counts, total) in _histograms.items()}
+    for name, labels, value in extra_counters:
+        counters[_key(name, labels)] = value
+
+    lines = []
+    for name, (kind, help_text) in HELP.items():
+        series = sorted((k, v) for k, v in (histograms if kind == 'histogram' else counters).items() if k[0] == name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for (_, labels), value in series:
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {value}')
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {total:.6f}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
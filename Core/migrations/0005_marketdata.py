@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-17 17:30
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0004_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarketData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search_term', models.CharField(max_length=255, unique=True)),
+                ('avg_price', models.FloatField(default=0)),
+                ('avg_shipping', models.FloatField(default=0)),
+                ('volume', models.IntegerField(default=0)),
+                ('link', models.TextField(default='#')),
+                ('fetched_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0006_analysisjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='summary',
+            field=models.TextField(default='{}'),
+        ),
+    ]
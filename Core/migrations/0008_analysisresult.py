@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-17 17:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0007_analysisjob_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('platform', models.CharField(db_index=True, max_length=20)),
+                ('row_number', models.IntegerField(default=0)),
+                ('sku', models.TextField(blank=True, default='')),
+                ('upc', models.CharField(blank=True, db_index=True, default='', max_length=100)),
+                ('title', models.TextField(blank=True, default='')),
+                ('cost', models.FloatField(default=0)),
+                ('actual_price', models.FloatField(default=0)),
+                ('avg_sold_price', models.FloatField(default=0)),
+                ('estimated_fees', models.FloatField(default=0)),
+                ('estimated_shipping', models.FloatField(default=0)),
+                ('estimated_profit', models.FloatField(db_index=True, default=0)),
+                ('profit_margin', models.FloatField(db_index=True, default=0)),
+                ('roi', models.FloatField(db_index=True, default=0)),
+                ('monthly_volume', models.IntegerField(default=0)),
+                ('link', models.TextField(default='#')),
+                ('optional_1', models.TextField(blank=True, default='')),
+                ('optional_2', models.TextField(blank=True, default='')),
+                ('optional_3', models.TextField(blank=True, default='')),
+                ('optional_1_name', models.CharField(blank=True, default='', max_length=255)),
+                ('optional_2_name', models.CharField(blank=True, default='', max_length=255)),
+                ('optional_3_name', models.CharField(blank=True, default='', max_length=255)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('raw_csv', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='Core.rawcsv')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['raw_csv', 'platform', '-profit_margin'], name='core_result_file_margin_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,122 @@
+import json
+
+from django.db import migrations
+
+BLOB_FIELDS = {'ebay': 'EbayData', 'walmart': 'WalmartData'}
+
+NUMERIC_FIELDS = {
+    'Cost': 'cost',
+    'ActualPrice': 'actual_price',
+    'avg_sold_price': 'avg_sold_price',
+    'estimated_fees': 'estimated_fees',
+    'estimated_shipping': 'estimated_shipping',
+    'estimated_profit': 'estimated_profit',
+    'profit_margin': 'profit_margin',
+    'roi': 'roi',
+}
+TEXT_FIELDS = {
+    'SKU': 'sku',
+    'Title': 'title',
+    'optional_1': 'optional_1',
+    'optional_2': 'optional_2',
+    'optional_3': 'optional_3',
+    'optional_1_name': 'optional_1_name',
+    'optional_2_name': 'optional_2_name',
+    'optional_3_name': 'optional_3_name',
+}
+
+
+def _to_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return value if value == value else 0.0
+
+
+def _to_text(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return str(value)
+
+
+def _load_blob(blob):
+    try:
+        return json.loads(blob)
+    except json.JSONDecodeError:
+        # getData() used to retry with single quotes normalized, so accept what it accepted
+        try:
+            return json.loads(blob.replace("'", '"'))
+        except json.JSONDecodeError:
+            return None
+
+
+def blobs_to_rows(apps, schema_editor):
+    RawCsv = apps.get_model('Core', 'RawCsv')
+    AnalysisResult = apps.get_model('Core', 'AnalysisResult')
+
+    for instance in RawCsv.objects.iterator():
+        changed = False
+        for platform, blob_field in BLOB_FIELDS.items():
+            blob = getattr(instance, blob_field)
+            if not blob:
+                continue
+            data = _load_blob(blob)
+            if not isinstance(data, list):
+                # Leave blobs we cannot read in place rather than losing them
+                continue
+            AnalysisResult.objects.bulk_create(
+                (
+                    AnalysisResult(
+                        raw_csv=instance,
+                        platform=platform,
+                        row_number=row_number,
+                        upc=_to_text(row.get('UPC')).strip()[:100],
+                        monthly_volume=int(_to_float(row.get('monthly_volume'))),
+                        link=_to_text(row.get('ebay_link', row.get('walmart_link', '#'))) or '#',
+                        error=row.get('error'),
+                        **{field: _to_float(row.get(key)) for key, field in NUMERIC_FIELDS.items()},
+                        **{field: _to_text(row.get(key)) for key, field in TEXT_FIELDS.items()},
+                    )
+                    for row_number, row in enumerate(data) if isinstance(row, dict)
+                ),
+                batch_size=500,
+            )
+            setattr(instance, blob_field, None)
+            changed = True
+        if changed:
+            instance.save(update_fields=list(BLOB_FIELDS.values()))
+
+
+def rows_to_blobs(apps, schema_editor):
+    RawCsv = apps.get_model('Core', 'RawCsv')
+    AnalysisResult = apps.get_model('Core', 'AnalysisResult')
+
+    for instance in RawCsv.objects.iterator():
+        for platform, blob_field in BLOB_FIELDS.items():
+            rows = AnalysisResult.objects.filter(raw_csv=instance, platform=platform).order_by('-profit_margin', 'row_number')
+            data = []
+            for result in rows:
+                row = {'UPC': result.upc}
+                row.update({key: getattr(result, field) for key, field in TEXT_FIELDS.items()})
+                row.update({key: getattr(result, field) for key, field in NUMERIC_FIELDS.items()})
+                row['monthly_volume'] = result.monthly_volume
+                row['ebay_link' if platform == 'ebay' else 'walmart_link'] = result.link
+                if result.error:
+                    row['error'] = result.error
+                data.append(row)
+            if data:
+                setattr(instance, blob_field, json.dumps(data))
+        instance.save(update_fields=list(BLOB_FIELDS.values()))
+    AnalysisResult.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0008_analysisresult'),
+    ]
+
+    operations = [
+        migrations.RunPython(blobs_to_rows, rows_to_blobs),
+    ]
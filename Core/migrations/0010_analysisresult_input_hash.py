@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-17 17:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0009_move_result_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='input_hash',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+    ]
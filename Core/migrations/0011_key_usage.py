@@ -0,0 +1,38 @@
+# Generated by Django 5.2 on 2026-10-17 18:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0010_analysisresult_input_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='key',
+            name='calls_today',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='key',
+            name='daily_limit',
+            field=models.IntegerField(default=5000),
+        ),
+        migrations.AddField(
+            model_name='key',
+            name='disabled_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='key',
+            name='last_error',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='key',
+            name='usage_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
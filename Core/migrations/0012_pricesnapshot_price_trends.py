@@ -0,0 +1,43 @@
+# Generated by Django 5.2 on 2026-10-17 19:11
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Core', '0011_key_usage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisresult',
+            name='avg_price_30d',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='avg_price_7d',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='analysisresult',
+            name='price_trend',
+            field=models.FloatField(default=0),
+        ),
+        migrations.CreateModel(
+            name='PriceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('search_term', models.CharField(max_length=255)),
+                ('avg_price', models.FloatField(default=0)),
+                ('avg_shipping', models.FloatField(default=0)),
+                ('volume', models.IntegerField(default=0)),
+                ('taken_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['search_term', '-taken_at'], name='core_snapshot_term_time_idx')],
+            },
+        ),
+    ]
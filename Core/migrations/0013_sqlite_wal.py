@@ -0,0 +1,29 @@
+from django.db import migrations
+
+
+def enable_wal(apps, schema_editor):
+    # Analysis worker threads write while pages read; WAL keeps readers off the writer's lock.
+    # The journal mode is stored in the database file, so this runs once per database,
+    # as part of `migrate`, rather than on every connection.
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=WAL;')
+
+
+def disable_wal(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode=DELETE;')
+
+
+class Migration(migrations.Migration):
+    # SQLite can't change the journal mode inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('Core', '0012_pricesnapshot_price_trends'),
+    ]
+
+    operations = [
+        migrations.RunPython(enable_wal, disable_wal),
+    ]
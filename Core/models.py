@@ -18,7 +18,196 @@ class Key(models.Model):
     Client_Id = models.CharField(max_length=500)
     Client_Secret = models.CharField(max_length=500)
     Approved = models.BooleanField(default=False)
+    # Browse API calls this app may make per day, and how many it has made today
+    daily_limit = models.IntegerField(default=5000)
+    calls_today = models.IntegerField(default=0)
+    usage_date = models.DateField(blank=True, null=True)
+    # Set when eBay throttles the key; it is skipped until then
+    disabled_until = models.DateTimeField(blank=True, null=True)
+    last_error = models.CharField(max_length=255, blank=True, default='')
 
     def __str__(self):
         return str(self.Approved) +" - " +str(self.id)
-    
\ No newline at end of file
+    
+class MarketData(models.Model):
+    search_term = models.CharField(max_length=255, unique=True)
+    avg_price = models.FloatField(default=0)
+    avg_shipping = models.FloatField(default=0)
+    volume = models.IntegerField(default=0)
+    link = models.TextField(default='#')
+    fetched_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return self.search_term
+
+class PriceSnapshot(models.Model):
+    # One per eBay market lookup, kept after the cache entry is refreshed; see price_history
+    search_term = models.CharField(max_length=255)
+    avg_price = models.FloatField(default=0)
+    avg_shipping = models.FloatField(default=0)
+    volume = models.IntegerField(default=0)
+    taken_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['search_term', '-taken_at'], name='core_snapshot_term_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.search_term} @ {self.taken_at:%Y-%m-%d %H:%M}"
+
+class AnalysisJob(models.Model):
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    raw_csv = models.ForeignKey(RawCsv, on_delete=models.CASCADE, related_name='jobs')
+    platform = models.CharField(max_length=20, default='ebay')
+    options = models.TextField(default='{}')
+    summary = models.TextField(default='{}')
+    source = models.CharField(max_length=500)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    total = models.IntegerField(default=0)
+    processed = models.IntegerField(default=0)
+    errors = models.IntegerField(default=0)
+    resumed_from = models.IntegerField(default=0)
+    error_message = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.raw_csv.name} - {self.status} ({self.processed}/{self.total})"
+
+
+def _to_float(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return value if value == value else 0.0
+
+
+def _to_text(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    return str(value)
+
+
+class AnalysisResult(models.Model):
+    # Row dict keys (as built by analysis.process_item) -> numeric model fields
+    NUMERIC_FIELDS = {
+        'Cost': 'cost',
+        'ActualPrice': 'actual_price',
+        'avg_sold_price': 'avg_sold_price',
+        'estimated_fees': 'estimated_fees',
+        'estimated_shipping': 'estimated_shipping',
+        'estimated_profit': 'estimated_profit',
+        'profit_margin': 'profit_margin',
+        'roi': 'roi',
+        'avg_price_7d': 'avg_price_7d',
+        'avg_price_30d': 'avg_price_30d',
+        'price_trend': 'price_trend',
+    }
+    TEXT_FIELDS = {
+        'SKU': 'sku',
+        'Title': 'title',
+        'optional_1': 'optional_1',
+        'optional_2': 'optional_2',
+        'optional_3': 'optional_3',
+        'optional_1_name': 'optional_1_name',
+        'optional_2_name': 'optional_2_name',
+        'optional_3_name': 'optional_3_name',
+    }
+
+    raw_csv = models.ForeignKey(RawCsv, on_delete=models.CASCADE, related_name='results')
+    platform = models.CharField(max_length=20, db_index=True)
+    row_number = models.IntegerField(default=0)
+    # analysis.input_hashes() of the input row, so a re-upload can reuse unchanged rows
+    input_hash = models.CharField(max_length=16, blank=True, default='')
+    sku = models.TextField(blank=True, default='')
+    upc = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    title = models.TextField(blank=True, default='')
+    cost = models.FloatField(default=0)
+    actual_price = models.FloatField(default=0)
+    avg_sold_price = models.FloatField(default=0)
+    estimated_fees = models.FloatField(default=0)
+    estimated_shipping = models.FloatField(default=0)
+    estimated_profit = models.FloatField(default=0, db_index=True)
+    profit_margin = models.FloatField(default=0, db_index=True)
+    roi = models.FloatField(default=0, db_index=True)
+    monthly_volume = models.IntegerField(default=0)
+    # From the search term's price history (price_history.trends), including this lookup
+    avg_price_7d = models.FloatField(default=0)
+    avg_price_30d = models.FloatField(default=0)
+    price_trend = models.FloatField(default=0)
+    link = models.TextField(default='#')
+    optional_1 = models.TextField(blank=True, default='')
+    optional_2 = models.TextField(blank=True, default='')
+    optional_3 = models.TextField(blank=True, default='')
+    optional_1_name = models.CharField(max_length=255, blank=True, default='')
+    optional_2_name = models.CharField(max_length=255, blank=True, default='')
+    optional_3_name = models.CharField(max_length=255, blank=True, default='')
+    error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['raw_csv', 'platform', '-profit_margin'], name='core_result_file_margin_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.upc or self.title} ({self.platform})"
+
+    @classmethod
+    def from_row(cls, raw_csv, platform, row, row_number=0, input_hash=''):
+        """Build an unsaved instance from one result row dict."""
+        fields = {field: _to_float(row.get(key)) for key, field in cls.NUMERIC_FIELDS.items()}
+        fields.update({field: _to_text(row.get(key)) for key, field in cls.TEXT_FIELDS.items()})
+        return cls(
+            raw_csv=raw_csv,
+            platform=platform,
+            row_number=row_number,
+            input_hash=input_hash,
+            upc=_to_text(row.get('UPC')).strip()[:100],
+            monthly_volume=int(_to_float(row.get('monthly_volume'))),
+            link=_to_text(row.get('ebay_link', row.get('walmart_link', '#'))) or '#',
+            error=row.get('error'),
+            **fields,
+        )
+
+    def as_row(self):
+        """The row dict shape (and key order) the analyze page has always received."""
+        row = {
+            'SKU': self.sku,
+            'UPC': self.upc,
+            'Title': self.title,
+            'Cost': self.cost,
+            'ActualPrice': self.actual_price,
+            'optional_1': self.optional_1,
+            'optional_2': self.optional_2,
+            'optional_3': self.optional_3,
+        }
+        if self.error:
+            row['error'] = self.error
+        row.update({
+            'avg_sold_price': self.avg_sold_price,
+            'estimated_fees': self.estimated_fees,
+            'estimated_shipping': self.estimated_shipping,
+            'estimated_profit': self.estimated_profit,
+            'profit_margin': self.profit_margin,
+            'roi': self.roi,
+            'monthly_volume': self.monthly_volume,
+            'avg_price_7d': self.avg_price_7d,
+            'avg_price_30d': self.avg_price_30d,
+            'price_trend': self.price_trend,
+            'ebay_link' if self.platform == 'ebay' else 'walmart_link': self.link,
+            'optional_1_name': self.optional_1_name,
+            'optional_2_name': self.optional_2_name,
+            'optional_3_name': self.optional_3_name,
+        })
+        return row
@@ -0,0 +1,104 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Avg, F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from . import market_cache
+from .models import PriceSnapshot
+
+logger = logging.getLogger(__name__)
+
+PRICE_HISTORY_RETENTION_DAYS = getattr(settings, 'PRICE_HISTORY_RETENTION_DAYS', 180)
+PRICE_HISTORY_QUERY_BATCH = getattr(settings, 'PRICE_HISTORY_QUERY_BATCH', 500)
+
+# Trend columns of a result row whose search term has no price history with listings
+NO_TREND = {'avg_price_7d': 0.0, 'avg_price_30d': 0.0, 'price_trend': 0.0}
+SNAPSHOT_FIELDS = ('taken_at', 'avg_price', 'avg_shipping', 'volume')
+
+
+def record(search_term, avg_price, avg_shipping, volume, source='active'):
+    """Append one market lookup to the search term's history; each source has its own."""
+    PriceSnapshot.objects.create(
+        search_term=market_cache.cache_key(search_term, source),
+        avg_price=avg_price,
+        avg_shipping=avg_shipping,
+        volume=volume,
+    )
+
+
+def _batches(keys):
+    batch = list(keys)
+    for start in range(0, len(batch), PRICE_HISTORY_QUERY_BATCH):
+        yield batch[start:start + PRICE_HISTORY_QUERY_BATCH]
+
+
+def averages(search_terms, source='active'):
+    """
+    (7-day, 30-day) average price per search term, one grouped query per batch of terms.
+
+    Only snapshots that found listings count; a lookup without any says nothing about the
+    price. Terms with no such snapshot in the last 30 days are left out.
+    """
+    now = timezone.now()
+    week, month = now - timedelta(days=7), now - timedelta(days=30)
+    keys = market_cache.cache_keys(search_terms, source)
+    found = {}
+    for batch in _batches(keys):
+        rows = PriceSnapshot.objects.filter(
+            search_term__in=batch, taken_at__gte=month, volume__gt=0,
+        ).values('search_term').annotate(
+            avg_7d=Avg('avg_price', filter=Q(taken_at__gte=week)),
+            avg_30d=Avg('avg_price'),
+        ).values_list('search_term', 'avg_7d', 'avg_30d')
+        for key, avg_7d, avg_30d in rows:
+            for term in keys[key]:
+                found[term] = avg_7d or 0.0, avg_30d
+    return found
+
+
+def trends(search_terms, source='active'):
+    """
+    The trend columns of a result row, per search term.
+
+    price_trend is the 7-day average's change against the 30-day one, in percent:
+    positive while the price is rising.
+    """
+    found = averages(search_terms, source)
+    out = {}
+    for term in search_terms:
+        if term not in found:
+            out[term] = NO_TREND
+            continue
+        avg_7d, avg_30d = found[term]
+        out[term] = {
+            'avg_price_7d': round(avg_7d, 2),
+            'avg_price_30d': round(avg_30d, 2),
+            'price_trend': round((avg_7d - avg_30d) / avg_30d * 100, 2) if avg_7d and avg_30d else 0.0,
+        }
+    return out
+
+
+def last_snapshots(search_terms, source='active', limit=10):
+    """The `limit` newest snapshots per search term, newest first, one query per batch of terms."""
+    keys = market_cache.cache_keys(search_terms, source)
+    out = {term: [] for term in search_terms}
+    for batch in _batches(keys):
+        rows = PriceSnapshot.objects.filter(search_term__in=batch).annotate(
+            rank=Window(RowNumber(), partition_by=F('search_term'), order_by=F('taken_at').desc()),
+        ).filter(rank__lte=limit).order_by('search_term', '-taken_at').values_list('search_term', *SNAPSHOT_FIELDS)
+        for key, *snapshot in rows:
+            for term in keys[key]:
+                out[term].append(dict(zip(SNAPSHOT_FIELDS, snapshot)))
+    return out
+
+
+def prune():
+    """Drop snapshots older than PRICE_HISTORY_RETENTION_DAYS."""
+    cutoff = timezone.now() - timedelta(days=PRICE_HISTORY_RETENTION_DAYS)
+    deleted, _ = PriceSnapshot.objects.filter(taken_at__lt=cutoff).delete()
+    if deleted:
+        logger.info(f"Price history pruned {deleted} snapshots")
+    return deleted
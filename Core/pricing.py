@@ -0,0 +1,131 @@
+import numbers
+
+import numpy as np
+import pandas as pd
+
+from .analysis import EBAY_FEE_PERCENTAGE, DEFAULT_SHIPPING_COST, WALMART_FEE_PERCENTAGE, process_item
+from .market_data import EMPTY_MARKET_DATA
+
+OPTIONAL_NAMES = ['optional_name_1', 'optional_name_2', 'optional_name_3']
+
+
+def round2(values):
+    """
+    Vectorized round(x, 2) that matches Python's builtin exactly.
+
+    np.round scales by 100 first, which can move a value that is not really a tie onto .5;
+    those few near-ties are re-rounded with the builtin.
+    """
+    values = np.asarray(values, dtype=float)
+    scaled = values * 100
+    rounded = np.round(scaled) / 100
+    near_tie = np.abs(np.abs(scaled - np.trunc(scaled)) - 0.5) < 1e-6
+    if near_tie.any():
+        rounded[near_tie] = [round(float(v), 2) for v in values[near_tie]]
+    return rounded
+
+
+def _column(df, name, default):
+    return df[name] if name in df.columns else pd.Series([default] * len(df), index=df.index, dtype=object)
+
+
+def _is_plain_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool) and value == value
+
+
+def _plain_numbers(series):
+    # Numeric columns only need a NaN check; object columns are checked value by value
+    if pd.api.types.is_bool_dtype(series):
+        return pd.Series(False, index=series.index)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.notna()
+    return series.map(_is_plain_number)
+
+
+def compute_metrics(items, market_data, platform="ebay", col_names=None):
+    """
+    Fee, shipping, profit, margin and ROI for a whole batch at once.
+
+    `items` is the mapped DataFrame and `market_data` one (avg_price, avg_shipping, volume, link)
+    tuple per row, or None where the lookup failed. Returns the same row dicts process_item()
+    would, in the same order. Rows whose Cost/ActualPrice are not plain numbers go through
+    process_item() so its error handling applies.
+    """
+    items = items.reset_index(drop=True)
+    n = len(items)
+    if not n:
+        return []
+
+    market_data = [m or EMPTY_MARKET_DATA for m in market_data]
+    market = pd.DataFrame(market_data, columns=['avg_price', 'avg_shipping', 'volume', 'link'])
+    optional_names = [col_names.get(name, "") if col_names else "" for name in OPTIONAL_NAMES]
+
+    raw_cost = _column(items, 'Cost', 0)
+    raw_actual = _column(items, 'ActualPrice', None)
+    if 'ActualPrice' not in items.columns:
+        raw_actual = raw_cost
+    plain = _plain_numbers(raw_cost) & _plain_numbers(raw_actual)
+
+    cost = raw_cost.where(plain, 0).astype(float).to_numpy()
+    actual_price = raw_actual.where(plain, 0).astype(float).to_numpy()
+    # float(x or cost): a zero actual price falls back to cost
+    actual_price = np.where(actual_price == 0, cost, actual_price)
+
+    if platform == "walmart":
+        avg_price = np.zeros(n)
+        avg_shipping = np.zeros(n)
+        roi = np.zeros(n)
+        volume = pd.Series([0.0] * n)
+        link = pd.Series([0.0] * n)
+    else:
+        avg_price = market['avg_price'].astype(float).to_numpy()
+        avg_shipping = market['avg_shipping'].astype(float).to_numpy()
+        volume = market['volume']
+        link = market['link']
+        listed = volume.to_numpy() != 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            roi = np.where(listed & (cost != 0), (avg_price - avg_shipping - cost) / cost * 100, 0.0)
+        avg_price = np.where(listed, avg_price, 0.0)
+        avg_shipping = np.where(listed, avg_shipping, 0.0)
+        volume = volume.where(listed, 0)
+        link = link.where(listed, '#')
+
+    platform_fee_percentage = EBAY_FEE_PERCENTAGE if platform == "ebay" else WALMART_FEE_PERCENTAGE
+    platform_link_key = 'ebay_link' if platform == "ebay" else 'walmart_link'
+
+    estimated_fee = avg_price * platform_fee_percentage
+    estimated_shipping = np.where(avg_shipping != 0, avg_shipping, DEFAULT_SHIPPING_COST)
+    profit = avg_price - actual_price - estimated_fee - estimated_shipping
+    with np.errstate(divide='ignore', invalid='ignore'):
+        margin = np.where(avg_price > 0, profit / avg_price * 100, 0)
+
+    columns = {
+        'SKU': _column(items, 'SKU', ''),
+        'UPC': _column(items, 'UPC', '').astype(str).str.strip(),
+        'Title': _column(items, 'Title', '').astype(str).str.strip(),
+        'Cost': round2(cost),
+        'ActualPrice': round2(actual_price),
+        'optional_1': _column(items, optional_names[0], ''),
+        'optional_2': _column(items, optional_names[1], ''),
+        'optional_3': _column(items, optional_names[2], ''),
+        'avg_sold_price': round2(avg_price),
+        'estimated_fees': round2(estimated_fee),
+        'estimated_shipping': round2(estimated_shipping),
+        'estimated_profit': round2(profit),
+        'profit_margin': round2(margin),
+        'roi': round2(roi),
+        'monthly_volume': volume.to_numpy(),
+        platform_link_key: link.to_numpy(),
+        'optional_1_name': optional_names[0],
+        'optional_2_name': optional_names[1],
+        'optional_3_name': optional_names[2],
+    }
+    # Plain lists box values as Python scalars, much faster than DataFrame.to_dict()
+    columns = {key: value.tolist() if hasattr(value, 'tolist') else [value] * n for key, value in columns.items()}
+    results = [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+    if not plain.all():
+        records = items.to_dict(orient='records')
+        for i in np.flatnonzero(~plain.to_numpy()):
+            results[i] = process_item(records[i], platform, col_names, market_data[i])
+    return results
@@ -0,0 +1,93 @@
+import hashlib
+
+import orjson
+from django.conf import settings
+from django.core.paginator import Paginator
+
+from .models import AnalysisResult
+
+RESULTS_PAGE_SIZE = getattr(settings, 'RESULTS_PAGE_SIZE', 50)
+RESULTS_MAX_PAGE_SIZE = getattr(settings, 'RESULTS_MAX_PAGE_SIZE', 500)
+
+# Row keys the analyze page sorts and filters by -> AnalysisResult fields
+NUMERIC_FIELDS = dict(AnalysisResult.NUMERIC_FIELDS, monthly_volume='monthly_volume')
+SORT_FIELDS = dict(NUMERIC_FIELDS, UPC='upc', SKU='sku', Title='title')
+FILTER_LOOKUPS = ('gt', 'lt', 'exact', 'gte', 'lte')
+DEFAULT_ORDERING = ['-profit_margin', 'row_number']
+
+
+def _int(value, default):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def filter_results(queryset, params):
+    """
+    Apply `<row key>__<lookup>=<number>` filters, e.g. profit_margin__gt=30.
+
+    Unknown keys and non-numeric values are ignored, as the page always did.
+    """
+    for param, value in params.items():
+        key, _, lookup = param.rpartition('__')
+        if key not in NUMERIC_FIELDS or lookup not in FILTER_LOOKUPS:
+            continue
+        try:
+            value = float(value)
+        except ValueError:
+            continue
+        if value != value:
+            continue
+        queryset = queryset.filter(**{f'{NUMERIC_FIELDS[key]}__{lookup}': value})
+    return queryset
+
+
+def order_results(queryset, params):
+    field = SORT_FIELDS.get(params.get('sort'))
+    if not field:
+        return queryset.order_by(*DEFAULT_ORDERING)
+    prefix = '-' if params.get('order') == 'desc' else ''
+    # row_number keeps equal values in a stable order across pages
+    return queryset.order_by(prefix + field, 'row_number')
+
+
+def page(instance, platform, params):
+    """
+    One page of a file's results: (meta, rows).
+
+    `meta` holds the counts the page needs for paging; `rows` is the unevaluated queryset slice.
+    """
+    rows = instance.results.filter(platform=platform)
+    total = rows.count()
+    first = rows.order_by(*DEFAULT_ORDERING).first()
+
+    filtered = order_results(filter_results(rows, params), params)
+    limit = min(max(_int(params.get('limit'), RESULTS_PAGE_SIZE), 1), RESULTS_MAX_PAGE_SIZE)
+    current = Paginator(filtered, limit).get_page(_int(params.get('page'), 1))
+
+    meta = {
+        # The top row decides which optional columns the table shows, whatever page is open
+        'header': first.as_row() if first else None,
+        'total': total,
+        'filtered': current.paginator.count,
+        'page': current.number,
+        'pages': current.paginator.num_pages,
+        'limit': limit,
+    }
+    return meta, current.object_list
+
+
+def stream(meta, rows):
+    """Yield `{...meta, "results": [...]}` as JSON, one row at a time."""
+    yield orjson.dumps(meta)[:-1] + b',"results":['
+    for i, row in enumerate(rows.iterator()):
+        yield (b',' if i else b'') + orjson.dumps(row.as_row())
+    yield b']}'
+
+
+def etag(instance, platform, written_at, params):
+    """Validator for one page: changes when the file is re-analysed or the query changes."""
+    query = '&'.join(f'{k}={v}' for k, v in sorted(params.items()))
+    key = f'{instance.pk}:{platform}:{written_at.timestamp()}:{query}'
+    return '"%s"' % hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
@@ -1,3 +1,743 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import timedelta
+from unittest import mock
+from xml.etree import ElementTree
 
-# Create your tests here.
+import pandas as pd
+import requests
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from . import artifacts, budget, ingest, jobs, market_cache
+from .analysis import process_item
+from .ebay_auth import TokenManager
+from .fetch_engine import CircuitBreaker, FetchEngine, SingleFlight, TokenBucket
+from .key_pool import KeyPool, NoKeyAvailable
+from .market_data import EMPTY_MARKET_DATA
+from .models import AnalysisJob, AnalysisResult, Key, MarketData, RawCsv
+from .pricing import compute_metrics
+
+
+def _http_error(status, rotated=False):
+    response = requests.Response()
+    response.status_code = status
+    error = requests.HTTPError(response=response)
+    if rotated:
+        error.rotated = True
+    return error
+
+
+def _temp_artifact_dir(test):
+    """Point the artifact store at a directory removed after `test`."""
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    patcher = mock.patch.object(artifacts, 'ARTIFACT_DIR', directory)
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+def _queue_job(raw_csv, items, **options):
+    """A queued job over `items`, stored as already-mapped rows the way jobs from before lazy parsing were."""
+    source = artifacts.create()
+    source.append(items)
+    return AnalysisJob.objects.create(
+        raw_csv=raw_csv, platform='ebay', source=source.id,
+        options=json.dumps({'col_names': {}, **options}),
+    )
+
+
+def _analysed(name, rows, platform='ebay'):
+    """A file whose analysis for `platform` finished with `rows`."""
+    raw_csv = RawCsv.objects.create(name=name)
+    AnalysisJob.objects.create(raw_csv=raw_csv, platform=platform, status='done', finished_at=timezone.now())
+    AnalysisResult.objects.bulk_create(
+        AnalysisResult.from_row(raw_csv, platform, row, row_number) for row_number, row in enumerate(rows)
+    )
+    return raw_csv
+
+
+def _calls(*outcomes):
+    """A blocking call that raises or returns each of `outcomes` in turn, then returns 'ok'."""
+    outcomes = list(outcomes)
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            outcome = outcomes.pop(0) if outcomes else 'ok'
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    return call
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def tripped(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+        breaker.record_failure()
+        breaker.record_failure()
+        return breaker
+
+    def test_opens_after_threshold_and_admits_one_probe(self):
+        breaker = self.tripped()
+        delay, probe = breaker._admit()
+        self.assertGreater(delay, 0)
+        self.assertIsNone(probe)
+
+        time.sleep(0.06)
+        delay, probe = breaker._admit()
+        self.assertEqual(delay, 0)
+        self.assertIsNotNone(probe)
+        # Everyone else waits on the probe
+        self.assertEqual(breaker._admit(), (0.1, None))
+
+    def test_successful_probe_closes(self):
+        breaker = self.tripped()
+        time.sleep(0.06)
+        breaker._admit()
+        breaker.record_success()
+        self.assertEqual(breaker._admit(), (0, None))
+
+    def test_failed_probe_reopens(self):
+        breaker = self.tripped()
+        time.sleep(0.06)
+        breaker._admit()
+        breaker.record_failure()
+        self.assertGreater(breaker._admit()[0], 0)
+
+    def test_stale_release_leaves_a_newer_probe_alone(self):
+        breaker = self.tripped()
+        time.sleep(0.06)
+        _, first = breaker._admit()
+        breaker.record_failure()
+        time.sleep(0.06)
+        _, second = breaker._admit()
+        breaker.release(first)
+        self.assertEqual(breaker._admit(), (0.1, None))
+        breaker.release(second)
+        self.assertIsNotNone(breaker._admit()[1])
+
+
+class FetchEngineProbeTests(SimpleTestCase):
+    """A probe call that ends without a verdict must not leave every later call waiting."""
+
+    def engine(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=0.05)
+        breaker.record_failure()
+        breaker.record_failure()
+        time.sleep(0.06)
+        return FetchEngine(concurrency=2, limiter=TokenBucket(1000, 1000), breaker=breaker, attempts=2)
+
+    def run_lookups(self, engine, call, count=2):
+        async def lookup(engine, item):
+            try:
+                return await asyncio.wait_for(engine.call(call), 2)
+            except asyncio.TimeoutError:
+                return 'hung'
+            except Exception as e:
+                return type(e).__name__
+        return engine.map(lookup, range(count))
+
+    def test_non_retryable_probe(self):
+        for error in (RuntimeError("cache write failed"), _http_error(404)):
+            with self.subTest(error=type(error).__name__):
+                results = self.run_lookups(self.engine(), _calls(error))
+                self.assertEqual(sorted(results), sorted([type(error).__name__, 'ok']))
+
+    def test_probe_on_a_rotated_key(self):
+        self.assertEqual(self.run_lookups(self.engine(), _calls(_http_error(429, rotated=True))), ['ok', 'ok'])
+
+    def test_cancelled_probe(self):
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.2)
+            return 'slow'
+
+        async def lookup(engine, item):
+            probe = asyncio.ensure_future(engine.call(slow))
+            await asyncio.sleep(0.05)
+            probe.cancel()
+            return await asyncio.wait_for(engine.call(_calls()), 2)
+
+        self.assertEqual(self.engine().map(lookup, [0]), ['ok'])
+        self.assertTrue(started.is_set())
+
+
+class FetchEngineConnectionTests(SimpleTestCase):
+    def test_worker_threads_close_their_connections(self):
+        workers = set()
+        closed = []
+
+        def blocking(item):
+            workers.add(threading.get_ident())
+            time.sleep(0.01)
+            return item
+
+        async def lookup(engine, item):
+            return await engine.run(blocking, item)
+
+        closing = mock.Mock()
+        closing.close.side_effect = lambda: closed.append(threading.get_ident())
+        with mock.patch('Core.fetch_engine.connection', closing):
+            self.assertEqual(FetchEngine(concurrency=4).map(lookup, range(20)), list(range(20)))
+        self.assertGreater(len(workers), 1)
+        self.assertEqual(sorted(closed), sorted(workers))
+
+
+class SingleFlightTests(SimpleTestCase):
+    def test_waiters_get_the_leaders_error(self):
+        async def scenario():
+            flight = SingleFlight()
+            release = asyncio.Event()
+
+            async def failing():
+                await release.wait()
+                raise ValueError("lookup failed")
+
+            leader = asyncio.ensure_future(flight.run('term', failing))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.run('term', failing))
+            await asyncio.sleep(0)
+            self.assertEqual(flight.in_flight(), 1)
+            release.set()
+            results = await asyncio.gather(leader, follower, return_exceptions=True)
+            return flight, results
+
+        flight, results = asyncio.run(scenario())
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_waiters_are_not_cancelled_with_the_leader(self):
+        async def scenario():
+            flight = SingleFlight()
+
+            async def slow():
+                await asyncio.sleep(1)
+
+            leader = asyncio.ensure_future(flight.run('term', slow))
+            await asyncio.sleep(0)
+            follower = asyncio.ensure_future(flight.run('term', slow))
+            await asyncio.sleep(0)
+            leader.cancel()
+            return flight, await asyncio.gather(follower, return_exceptions=True)
+
+        flight, (result,) = asyncio.run(scenario())
+        self.assertIsInstance(result, RuntimeError)
+        self.assertEqual(flight.in_flight(), 0)
+
+    def test_result_is_shared(self):
+        async def scenario():
+            flight = SingleFlight()
+            calls = []
+
+            async def fetch():
+                calls.append(1)
+                await asyncio.sleep(0.01)
+                return 42
+
+            results = await asyncio.gather(*(flight.run('term', fetch) for _ in range(3)))
+            return calls, results
+
+        calls, results = asyncio.run(scenario())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [(42, False), (42, True), (42, True)])
+
+
+class BudgetPlanTests(TestCase):
+    def test_cached_terms_are_free_and_calls_go_to_the_best_terms(self):
+        raw_csv = RawCsv.objects.create(name='previous.csv')
+        AnalysisResult.objects.create(raw_csv=raw_csv, platform='ebay', upc='PROFIT', estimated_profit=50)
+        AnalysisResult.objects.create(raw_csv=raw_csv, platform='ebay', upc='LOSS', estimated_profit=-10)
+        market_cache.set('CACHED', 10.0, 1.0, 3, '#')
+        items = pd.DataFrame({
+            'UPC': ['LOSS', 'CHEAP', 'PROFIT', 'DEAR', 'CACHED'],
+            'Title': ['a', 'b', 'c', 'd', 'e'],
+            'ActualPrice': [500.0, 5.0, 1.0, 100.0, 1.0],
+        })
+
+        self.assertEqual(budget.plan(items, 'ebay', 'active', 2), {'CACHED', 'PROFIT', 'DEAR'})
+        self.assertEqual(budget.plan(items, 'ebay', 'active', 0), {'CACHED'})
+        # Losses come last, however much money is at stake
+        self.assertEqual(budget.plan(items, 'ebay', 'active', 4), {'CACHED', 'PROFIT', 'DEAR', 'CHEAP', 'LOSS'})
+        ranked = budget.priorities(items, 'ebay')
+        self.assertLess(ranked['LOSS'], ranked['CHEAP'])
+
+
+class MarketCacheCullTests(TestCase):
+    def test_size_limit_is_checked_every_n_stores(self):
+        with mock.patch.multiple(market_cache, MARKET_CACHE_MAX_ENTRIES=4, MARKET_CACHE_CULL_EVERY=5,
+                                 MARKET_CACHE_CULL_FREQUENCY=2, _stores_since_cull=0):
+            for i in range(4):
+                market_cache.set(f'term {i}', 10.0, 1.0, 3, '#')
+            with mock.patch.object(market_cache, '_cull', wraps=market_cache._cull) as cull:
+                market_cache.set('term 4', 10.0, 1.0, 3, '#')
+                market_cache.set('term 5', 10.0, 1.0, 3, '#')
+            self.assertEqual(cull.call_count, 1)
+        self.assertEqual(MarketData.objects.count(), 4)
+        self.assertFalse(MarketData.objects.filter(search_term='term 0').exists())
+
+
+class ComputeMetricsTests(SimpleTestCase):
+    def test_matches_process_item(self):
+        col_names = {'optional_name_1': 'Brand'}
+        items = pd.DataFrame({
+            'UPC': ['1', ' 2 ', '3', '4', '5', '6'],
+            'SKU': ['a', 'b', 'c', 'd', 'e', 'f'],
+            'Title': ['One', 'Two ', 'Three', 'Four', 'Five', 'Six'],
+            'Cost': [10.0, 0.0, 12.345, 'n/a', 99.99, 7.5],
+            'ActualPrice': [9.0, 0.0, 0.0, 3.0, 89.991, 7.5],
+            'Brand': ['x', 'y', 'z', 'w', 'v', 'u'],
+        })
+        market_data = [
+            (25.0, 4.0, 10, 'https://ebay/1'),
+            (19.995, 0.0, 3, 'https://ebay/2'),
+            None,
+            (30.0, 2.0, 1, 'https://ebay/4'),
+            (0.0, 0.0, 0, '#'),
+            (12.345, 1.005, 7, 'https://ebay/6'),
+        ]
+        records = items.to_dict(orient='records')
+        for platform in ('ebay', 'walmart'):
+            with self.subTest(platform=platform):
+                expected = [
+                    process_item(record, platform, col_names, market or EMPTY_MARKET_DATA)
+                    for record, market in zip(records, market_data)
+                ]
+                self.assertEqual(compute_metrics(items, market_data, platform, col_names), expected)
+
+
+class JobResumeTests(TransactionTestCase):
+    def setUp(self):
+        _temp_artifact_dir(self)
+
+    def test_resumes_from_the_checkpoint(self):
+        items = pd.DataFrame({
+            'UPC': [str(1000 + i) for i in range(60)],
+            'SKU': [f'SKU-{i}' for i in range(60)],
+            'Title': [f'Item {i}' for i in range(60)],
+            'Cost': [10.0] * 60,
+            'ActualPrice': [10.0] * 60,
+        })
+        job = _queue_job(RawCsv.objects.create(name='resume.csv'), items)
+        # A worker that died after checkpointing the first chunk
+        first = jobs.ANALYSIS_JOB_FIRST_CHUNK_SIZE
+        done = compute_metrics(items.iloc[:first], [(30.0, 2.0, 5, '#')] * first, 'ebay', {})
+        for row in done:
+            row['SKU'] = 'from checkpoint'
+        artifacts.open_writer(job.id).append(pd.DataFrame(done))
+
+        fetched = []
+
+        def fetch(search_term, source=None, spend=None):
+            fetched.append(search_term)
+            return 20.0, 1.0, 4, '#'
+
+        with mock.patch.object(jobs, 'fetch_and_cache', fetch):
+            jobs.run_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.total, job.resumed_from, job.processed), (60, first, 60))
+        self.assertEqual(sorted(fetched), sorted(items['UPC'][first:]))
+        rows = list(job.raw_csv.results.order_by('row_number'))
+        self.assertEqual(len(rows), 60)
+        self.assertTrue(all(row.sku == 'from checkpoint' for row in rows[:first]))
+        self.assertEqual([row.sku for row in rows[first:]], list(items['SKU'][first:]))
+        self.assertEqual(rows[-1].avg_sold_price, 20.0)
+        self.assertFalse(artifacts.exists(job.id))
+
+
+class ApiBudgetTests(TransactionTestCase):
+    def setUp(self):
+        _temp_artifact_dir(self)
+        patcher = mock.patch('Core.fetch_engine.backoff_delay', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_stop_when_the_budget_is_spent(self):
+        engine = FetchEngine(concurrency=1, limiter=TokenBucket(1000, 1000), breaker=CircuitBreaker(100, 1), attempts=4)
+        calls = []
+        allowed = iter([True, False])
+
+        def failing():
+            calls.append(1)
+            raise _http_error(500)
+
+        async def lookup(engine, item):
+            try:
+                await engine.call(failing, spend=lambda: next(allowed))
+            except requests.HTTPError as e:
+                return e.response.status_code
+        self.assertEqual(engine.map(lookup, [0]), [500])
+        # The first call is paid for by the caller, the one retry by spend()
+        self.assertEqual(len(calls), 2)
+
+    def test_every_request_is_charged(self):
+        items = pd.DataFrame({
+            'UPC': [str(1000 + i) for i in range(6)],
+            'Title': [f'Item {i}' for i in range(6)],
+            'Cost': [10.0] * 6,
+            'ActualPrice': [60.0, 50.0, 40.0, 30.0, 20.0, 10.0],
+        })
+        job = _queue_job(RawCsv.objects.create(name='budget.csv'), items, api_budget=3)
+        fetched = []
+
+        def fetch(search_term, source=None, spend=None):
+            fetched.append(search_term)
+            if search_term == '1000':
+                raise _http_error(500)
+            return 20.0, 1.0, 4, '#'
+
+        with mock.patch.object(jobs, 'fetch_and_cache', fetch):
+            jobs.run_job(job.id)
+
+        job.refresh_from_db()
+        summary = json.loads(job.summary)
+        self.assertEqual(len(fetched), 3)
+        self.assertEqual(summary['budget_spent'], 3)
+        rows = {row.upc: row for row in job.raw_csv.results.all()}
+        # The failed term's retries found no budget left; it keeps its own failure, not a budget skip
+        self.assertEqual(rows['1000'].error, f'{jobs.LOOKUP_FAILED}: HTTP 500')
+        skipped = [upc for upc, row in rows.items() if row.error == budget.BUDGET_SKIPPED]
+        self.assertEqual(summary['skipped_lookups'], len(skipped))
+        # Every other term was either looked up or skipped
+        self.assertEqual(sorted(set(fetched) | set(skipped)), sorted(items['UPC']))
+        self.assertFalse(set(fetched) & set(skipped))
+
+
+class IngestHeaderRowTests(SimpleTestCase):
+    """The header row is found in the same CSV records read_csv(skiprows=...) skips."""
+
+    SHEETS = {
+        # U+0085 once decoded as latin-1, which str.splitlines() treats as a line break
+        'latin-1 preamble': 'Supplier list \x85 Spring\r\nPrices valid \x85 now\r\n\r\nUPC,Title,Cost\r\n'
+                            '123,a,$1.00\r\n456,b,$2.00\r\n'.encode('latin-1'),
+        'quoted multi-line preamble': b'"Supplier notes\nline two\nline three",,\nUPC,Title,Cost\n123,a,$1.00\n456,b,$2.00\n',
+        'plain': b'UPC,Title,Cost\n123,a,$1.00\n456,b,$2.00\n',
+    }
+
+    def setUp(self):
+        _temp_artifact_dir(self)
+
+    def test_preview_and_load_items(self):
+        fields = {'upc_col': 'upc', 'title_col': 'title', 'cost_col': 'cost'}
+        for name, data in self.SHEETS.items():
+            with self.subTest(sheet=name):
+                file = io.BytesIO(data)
+                encoding, header_row = ingest.sniff(file)
+                self.assertEqual(ingest.preview(file, encoding, header_row)['columns'], ['upc', 'title', 'cost'])
+
+                items = ingest.load_items(artifacts.save_file(file), encoding, header_row, fields)
+                self.assertEqual(list(items['Title']), ['a', 'b'])
+                self.assertEqual(list(items['Cost']), [1.0, 2.0])
+
+    def test_no_header_row(self):
+        self.assertEqual(ingest.sniff(io.BytesIO(b'SKU,Title\n1,a\n')), ('utf-8', None))
+
+
+class ResultsDataTests(TestCase):
+    def setUp(self):
+        _analysed('results.csv', [
+            {'UPC': str(100 + i), 'SKU': f'SKU-{i}', 'profit_margin': margin, 'roi': roi}
+            for i, (margin, roi) in enumerate([(5, 50), (40, 10), (25, 30), (15, 20), (30, 40)])
+        ])
+
+    def get(self, **params):
+        response = self.client.get('/analyze/data', {'name': 'results.csv', 'platform': 'ebay', **params})
+        return response, json.loads(b''.join(response.streaming_content)) if response.streaming else response.json()
+
+    def test_default_page_is_sorted_by_margin(self):
+        response, data = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data['total'], data['filtered'], data['pages']), (5, 5, 1))
+        self.assertEqual([row['profit_margin'] for row in data['results']], [40, 30, 25, 15, 5])
+        self.assertEqual(data['header']['UPC'], '101')
+
+    def test_filter_sort_and_page(self):
+        _, data = self.get(profit_margin__gt='10', sort='roi', order='desc', limit='2', page='2')
+        self.assertEqual((data['total'], data['filtered'], data['page'], data['pages']), (5, 4, 2, 2))
+        self.assertEqual([row['roi'] for row in data['results']], [20, 10])
+
+    def test_bad_parameters_are_ignored(self):
+        _, data = self.get(profit_margin__gt='lots', Title__exact='1', limit='0', page='99')
+        self.assertEqual((data['filtered'], data['limit'], data['page']), (5, 1, 5))
+
+    def test_unknown_file_or_platform(self):
+        self.assertEqual(self.get(name='missing.csv')[0].status_code, 404)
+        self.assertEqual(self.get(platform='amazon')[0].status_code, 404)
+        self.assertEqual(self.get(platform='walmart')[0].status_code, 404)
+
+
+class ResultsCachingTests(TestCase):
+    def setUp(self):
+        self.raw_csv = _analysed('cached.csv', [{'UPC': str(100 + i), 'profit_margin': i} for i in range(3)])
+        self.params = {'name': 'cached.csv', 'platform': 'ebay'}
+
+    def test_unchanged_results_revalidate_with_304(self):
+        first = self.client.get('/analyze/data', self.params)
+        self.assertEqual(first.status_code, 200)
+        etag = first['ETag']
+        repeat = self.client.get('/analyze/data', self.params, headers={'If-None-Match': etag})
+        self.assertEqual(repeat.status_code, 304)
+        self.assertEqual(repeat['ETag'], etag)
+        # Another page is another validator
+        other = self.client.get('/analyze/data', {**self.params, 'page': '2'}, headers={'If-None-Match': etag})
+        self.assertEqual(other.status_code, 200)
+
+    def test_new_analysis_changes_the_etag(self):
+        etag = self.client.get('/analyze/data', self.params)['ETag']
+        AnalysisJob.objects.create(
+            raw_csv=self.raw_csv, platform='ebay', status='done', finished_at=timezone.now() + timedelta(seconds=1),
+        )
+        response = self.client.get('/analyze/data', self.params, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_gzipped_when_accepted(self):
+        response = self.client.get('/analyze/data', self.params, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        data = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(len(data['results']), 3)
+
+
+class ReanalysisTests(TransactionTestCase):
+    def setUp(self):
+        _temp_artifact_dir(self)
+
+    def run_job(self, raw_csv, items, failing=()):
+        fetched = []
+
+        def fetch(search_term, source=None, spend=None):
+            fetched.append(search_term)
+            if search_term in failing:
+                raise _http_error(404)
+            return 20.0, 1.0, 4, '#'
+
+        job = _queue_job(raw_csv, items)
+        with mock.patch.object(jobs, 'fetch_and_cache', fetch):
+            jobs.run_job(job.id)
+        job.refresh_from_db()
+        return job, sorted(fetched)
+
+    def test_only_changed_and_failed_rows_are_analysed_again(self):
+        raw_csv = RawCsv.objects.create(name='weekly.csv')
+        items = pd.DataFrame({
+            'UPC': [str(1000 + i) for i in range(6)],
+            'Title': [f'Item {i}' for i in range(6)],
+            'Cost': [10.0] * 6,
+            'ActualPrice': [10.0] * 6,
+        })
+        job, fetched = self.run_job(raw_csv, items, failing={'1005'})
+        # The failing term is tried again at the end of the job
+        self.assertEqual(fetched, sorted(list(items['UPC']) + ['1005']))
+        self.assertTrue(raw_csv.results.get(upc='1005').error.startswith(jobs.LOOKUP_FAILED))
+
+        updated = items.copy()
+        updated.loc[2, ['Cost', 'ActualPrice']] = 12.0
+        job, fetched = self.run_job(raw_csv, updated)
+        self.assertEqual(fetched, ['1002', '1005'])
+        self.assertEqual(json.loads(job.summary)['rows_reused'], 4)
+        rows = list(raw_csv.results.order_by('row_number'))
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[2].cost, 12.0)
+        self.assertTrue(all(row.error is None for row in rows))
+
+
+class KeyPoolTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.big = Key.objects.create(Client_Id='big', Client_Secret='s', Approved=True, daily_limit=3)
+        self.small = Key.objects.create(Client_Id='small', Client_Secret='s', Approved=True, daily_limit=1)
+        Key.objects.create(Client_Id='unapproved', Client_Secret='s', daily_limit=100)
+        self.pool = KeyPool(store_path=f'{directory}/token.json', rate=1000, burst=1000)
+
+    def test_calls_spread_by_quota_until_every_key_is_spent(self):
+        used = [self.pool.acquire().id for _ in range(4)]
+        self.assertEqual(used[0], self.big.id)
+        self.assertEqual(sorted(used), sorted([self.big.id] * 3 + [self.small.id]))
+        with self.assertRaises(NoKeyAvailable):
+            self.pool.acquire()
+        # Usage is written back, so other processes see the same quota
+        self.pool.flush()
+        self.assertEqual(Key.objects.get(id=self.big.id).calls_today, 3)
+        self.assertEqual(Key.objects.get(id=self.small.id).calls_today, 1)
+
+    def test_throttled_key_rests_and_the_call_moves_on(self):
+        slot = self.pool.acquire()
+        response = requests.Response()
+        response.status_code = 429
+        response.headers['Retry-After'] = '30'
+        with self.assertRaises(requests.HTTPError) as raised:
+            self.pool.raise_for_status(slot, response)
+        self.assertTrue(raised.exception.rotated)
+        self.assertIsNotNone(Key.objects.get(id=slot.id).disabled_until)
+        self.assertNotEqual(self.pool.acquire().id, slot.id)
+
+    def test_rejected_key_is_unapproved(self):
+        slot = self.pool.acquire()
+        with mock.patch.object(TokenManager, 'get_token', side_effect=_http_error(401)):
+            with self.assertRaises(requests.HTTPError) as raised:
+                self.pool.token(slot)
+        self.assertTrue(raised.exception.rotated)
+        self.assertFalse(Key.objects.get(id=slot.id).Approved)
+        self.assertEqual([entry['key'] for entry in self.pool.stats()], [self.small.id])
+        self.assertEqual(self.pool.acquire().id, self.small.id)
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        _analysed('export.csv', [
+            {'UPC': str(100 + i), 'Title': title, 'roi': roi, 'optional_1': f'brand {i}', 'optional_1_name': 'brand'}
+            for i, (title, roi) in enumerate([('Plain', 10), ('Comma, "quoted"', 30), ('Control\x01char', 20)])
+        ])
+        self.params = {'name': 'export.csv', 'platform': 'ebay', 'sort': 'roi', 'order': 'desc'}
+
+    def download(self, **params):
+        response = self.client.get('/analyze/export', {**self.params, **params})
+        return response, b''.join(response.streaming_content)
+
+    def test_csv(self):
+        response, body = self.download(format='csv', roi__gt='15')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('filename="export_ebay_analysis.csv"', response['Content-Disposition'])
+        header, *rows = csv.reader(io.StringIO(body.decode()))
+        self.assertEqual(header[:8], ['SKU', 'UPC', 'Title', 'Cost', 'ActualPrice', 'brand', 'optional_2', 'optional_3'])
+        self.assertIn('ebay_link', header)
+        self.assertEqual([row[1:3] for row in rows], [['101', 'Comma, "quoted"'], ['102', 'Control\x01char']])
+
+    def test_xlsx(self):
+        response, body = self.download(format='xlsx')
+        self.assertIn('filename="export_ebay_analysis.xlsx"', response['Content-Disposition'])
+        with zipfile.ZipFile(io.BytesIO(body)) as workbook:
+            self.assertIn('xl/workbook.xml', workbook.namelist())
+            sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        rows = sheet.findall('.//s:row', ns)
+        self.assertEqual(len(rows), 4)
+        cells = [''.join(cell.itertext()) for cell in rows[1]]
+        self.assertEqual(cells[1:3], ['101', 'Comma, "quoted"'])
+        # Characters XML can't carry are dropped rather than breaking the workbook
+        self.assertEqual(''.join(rows[2][2].itertext()), 'Controlchar')
+
+    def test_download_from_the_analyze_page_and_errors(self):
+        response = self.client.get('/', {**self.params, 'download': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/analyze/export', {**self.params, 'format': 'pdf'}).status_code, 400)
+        self.assertEqual(self.client.get('/analyze/export', {'name': 'missing.csv', 'platform': 'ebay'}).status_code, 404)
+
+
+class UploadPreviewTests(TestCase):
+    def setUp(self):
+        _temp_artifact_dir(self)
+        self.sheet = b'Supplier price list\n' + b'UPC,Title,Cost,Brand\n' + b''.join(
+            f'{1000 + i},Item {i},${i + 1}.00,Acme\n'.encode() for i in range(50)
+        )
+
+    def upload(self):
+        return self.client.post('/', {'file': SimpleUploadedFile('supplier.csv', self.sheet)})
+
+    def map_columns(self, **fields):
+        return self.client.post('/', {'map_action': 'map_columns', 'upc_col': 'upc', 'title_col': 'title',
+                                      'cost_col': 'cost', 'dis_col': '10', 'platform': 'ebay', **fields})
+
+    def test_preview_reads_only_the_sample(self):
+        data = self.upload().json()
+        self.assertTrue(data['success'])
+        self.assertEqual(data['columns'], ['upc', 'title', 'cost', 'brand'])
+        self.assertEqual(data['dtypes']['cost'], 'number')
+        self.assertEqual(len(data['sample']), ingest.UPLOAD_PREVIEW_ROWS)
+        # The upload is kept byte for byte, for the job to parse
+        with open(artifacts.file_path(self.client.session['upload_id']), 'rb') as f:
+            self.assertEqual(f.read(), self.sheet)
+
+    def test_mapping_is_checked_against_the_preview(self):
+        self.upload()
+        response = self.map_columns(optional_1='colour')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('colour', response.json()['error'])
+        self.assertEqual(self.map_columns(upc_col='').status_code, 400)
+
+    def test_sheet_without_upc_column(self):
+        self.sheet = b'SKU,Title\n1,a\n'
+        self.assertEqual(self.upload().status_code, 400)
+
+    def test_job_parses_the_mapped_columns(self):
+        self.upload()
+        with mock.patch.object(jobs, 'submit') as submit:
+            job_id = self.map_columns(optional_1='brand').json()['job']['id']
+        submit.assert_called_once()
+        with mock.patch.object(jobs, 'fetch_and_cache', return_value=(20.0, 1.0, 4, '#')):
+            jobs.run_job(job_id)
+
+        rows = list(AnalysisJob.objects.get(id=job_id).raw_csv.results.order_by('row_number'))
+        self.assertEqual(len(rows), 50)
+        self.assertEqual((rows[0].upc, rows[0].title, rows[0].cost), ('1000', 'Item 0', 1.0))
+        self.assertAlmostEqual(rows[0].actual_price, 0.9)
+        self.assertEqual((rows[0].optional_1_name, rows[0].optional_1), ('brand', 'Acme'))
+
+
+def _events(body):
+    """(event, id, data) of each Server-Sent Events frame in `body`."""
+    events = []
+    for block in body.decode().split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if line and not line.startswith(':'))
+        if fields:
+            events.append((fields['event'], fields.get('id'), json.loads(fields['data'])))
+    return events
+
+
+class JobStreamTests(TestCase):
+    def setUp(self):
+        _temp_artifact_dir(self)
+
+    async def read_stream(self, job_id, until, **headers):
+        response = await self.async_client.get(f'/jobs/{job_id}/stream', headers=headers)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''
+        try:
+            async for chunk in response.streaming_content:
+                body += chunk
+                if f'event: {until}'.encode() in body:
+                    break
+        finally:
+            await response.streaming_content.aclose()
+        return _events(body)
+
+    def test_finished_job_resumes_after_last_event_id(self):
+        raw_csv = _analysed('streamed.csv', [{'UPC': str(100 + i)} for i in range(5)])
+        job = raw_csv.jobs.get()
+        events = async_to_sync(self.read_stream)(job.id, 'done', **{'Last-Event-ID': '3'})
+        self.assertEqual([event for event, _, _ in events], ['progress', 'rows', 'done'])
+        _, event_id, data = events[1]
+        self.assertEqual(event_id, '5')
+        self.assertEqual([(row['row_number'], row['UPC']) for row in data['rows']], [(3, '103'), (4, '104')])
+
+    def test_running_job_resumes_from_the_checkpoint(self):
+        items = pd.DataFrame({'UPC': [str(1000 + i) for i in range(50)], 'Cost': [10.0] * 50, 'ActualPrice': [10.0] * 50})
+        job = AnalysisJob.objects.create(
+            raw_csv=RawCsv.objects.create(name='running.csv'), platform='ebay', status='running',
+            processed=50, total=80, heartbeat_at=timezone.now(),
+        )
+        checkpoint = artifacts.open_writer(job.id)
+        for start in (0, 25):
+            checkpoint.append(pd.DataFrame(compute_metrics(items.iloc[start:start + 25], [None] * 25, 'ebay', {})))
+
+        events = async_to_sync(self.read_stream)(job.id, 'rows', **{'Last-Event-ID': '25'})
+        event, event_id, data = events[0]
+        # The first chunk was delivered before the reconnect; only the second is sent again
+        self.assertEqual((event, event_id), ('rows', '50'))
+        self.assertEqual([row['row_number'] for row in data['rows']], list(range(25, 50)))
+        self.assertEqual(data['rows'][0]['UPC'], '1025')
@@ -4,4 +4,10 @@ from django.urls import path
 urlpatterns = [
     path('',analyze,name='Analyze'),
     path('analyze',getData,name='getdata'),    
+    path('analyze/data',results_data,name='results_data'),
+    path('analyze/export',results_export,name='results_export'),
+    path('jobs/<uuid:job_id>',job_status,name='job_status'),
+    path('jobs/<uuid:job_id>/stream',job_stream,name='job_stream'),
+    path('history',price_history_data,name='price_history'),
+    path('metrics',prometheus_metrics,name='metrics'),
 ]
\ No newline at end of file
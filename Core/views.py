@@ -1,234 +1,138 @@
-import csv, hashlib, io, json, traceback, logging
-import pandas as pd
-import requests
-from concurrent.futures import ThreadPoolExecutor
-from django.http import JsonResponse, HttpResponse
+import asyncio, traceback, logging
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Count, Max, Q
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date
+from django.utils import timezone
+from django.views.decorators.gzip import gzip_page
 from django.shortcuts import render
-from .models import RawCsv,Key
+from .models import RawCsv,Key,AnalysisJob
+from .fetch_engine import single_flight
+from . import artifacts, export, ingest, job_events, jobs, market_cache, market_data, metrics, price_history, results
 from django.views.decorators.csrf import csrf_exempt
 
 logger = logging.getLogger(__name__)
 
-EBAY_OAUTH_URL = 'https://api.ebay.com/identity/v1/oauth2/token'
-EBAY_SEARCH_URL = 'https://api.ebay.com/buy/browse/v1/item_summary/search'
-EBAY_SCOPE = 'https://api.ebay.com/oauth/api_scope'
-EBAY_FEE_PERCENTAGE = 0.13
-DEFAULT_SHIPPING_COST = 5.0
-WALMART_FEE_PERCENTAGE = 0.13
-
-# Cache the token to avoid frequent requests
-token_cache = {'token': None, 'expires_in': 0}
-
-def get_ebay_token():
-    key = Key.objects.filter(Approved=True).first()
-    EBAY_CLIENT_ID = key.Client_Id
-    EBAY_CLIENT_SECRET = key.Client_Secret
-
-    if token_cache['token']:
-        return token_cache['token']
-    response = requests.post(
-        EBAY_OAUTH_URL,
-        headers={'Content-Type': 'application/x-www-form-urlencoded'},
-        data={'grant_type': 'client_credentials', 'scope': EBAY_SCOPE},
-        auth=(EBAY_CLIENT_ID, EBAY_CLIENT_SECRET)
-    )
-    response.raise_for_status()
-    result = response.json()
-    token_cache['token'] = result['access_token']
-    return token_cache['token']
-
-
-def get_ebay_avg_price(search_term, cost):
-    try:
-        token = get_ebay_token()
-        headers = {'Authorization': f'Bearer {token}'}
-        params = {
-            'q': search_term,
-            'limit': 10,
-            'filter': 'conditionIds:{1000|3000|4000|5000},price:[5..1000]'
-        }
-
-        response = requests.get(EBAY_SEARCH_URL, headers=headers, params=params)
-        response.raise_for_status()
-        items = response.json().get('itemSummaries', [])
-        if not items:
-            return 0.0, 0.0, 0.0, 0, '#'
-
-        prices = [float(i['price']['value']) for i in items if 'price' in i]
-        shipping_prices = [
-            float(i.get('shippingOptions', [{}])[0].get('shippingCost', {}).get('value', 0.0)) for i in items
-        ]
-        total_volume = len(items)
-        ebay_url = items[0].get('itemWebUrl', '#')
-
-        avg_price = sum(prices) / len(prices)
-        avg_shipping = sum(shipping_prices) / len(shipping_prices) if shipping_prices else 0
-
-        estimated_profit = avg_price - avg_shipping - cost
-        roi = (estimated_profit / cost) * 100 if cost else 0.0
-
-        return (
-            avg_price,
-            avg_shipping,
-            roi,
-            total_volume,
-            ebay_url
-        )
-    except Exception as e:
-        logger.error(f"eBay fetch error for {search_term}: {e}")
-        return 0.0, 0.0, 0.0, 0, '#'
-
-
-
-def hash_item(item):
-    concat = f"{item.get('SKU', '')}-{item.get('UPC', '')}-{item.get('Title', '')}-{item.get('Cost', '')}-{item.get('ActualPrice', '')}-" \
-             f"{item.get('optional_1', '')}-{item.get('optional_2', '')}-{item.get('optional_3', '')}"
-    return hashlib.md5(concat.encode()).hexdigest()
-
-
-
-def process_item(item_data, platform="ebay",col_names=None):
+# Bytes of a results page or export handed from the sync thread to the event loop at a time
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+async def _in_thread(chunks):
+    """
+    A synchronous iterator that reads the database as it goes, as an async one.
+
+    It is advanced in Django's sync thread a batch of chunks at a time, so the event loop
+    never runs a query and the response still streams instead of being collected first.
+    """
+    pull = sync_to_async(_next_batch)
+    while data := await pull(chunks):
+        yield data
+
+
+def _next_batch(chunks):
+    out, size = [], 0
+    for chunk in chunks:
+        out.append(chunk)
+        size += len(chunk)
+        if size >= STREAM_CHUNK_BYTES:
+            break
+    return b''.join(out)
+
+
+def _blocking(chunks):
+    """An async iterator as a plain one, for responses served by a WSGI worker thread."""
+    # One loop for the whole response: a loop closing finalizes the async generators it ran
+    loop = asyncio.new_event_loop()
     try:
-        sku = item_data.get('SKU', '')
-        upc = str(item_data.get('UPC', '')).strip()
-        title = str(item_data.get('Title', '')).strip()
-        cost = float(item_data.get('Cost', 0) or 0.0)
-        actual_price = float(item_data.get('ActualPrice', cost) or cost)
-
-        # Optional fields from CSV
-        optional_name_1 = col_names.get("optional_name_1", "") if col_names else ""
-        optional_name_2 = col_names.get("optional_name_2", "") if col_names else ""
-        optional_name_3 = col_names.get("optional_name_3", "") if col_names else ""
-
-        optional_1 = item_data.get(optional_name_1, '')
-        optional_2 = item_data.get(optional_name_2, '')
-        optional_3 = item_data.get(optional_name_3, '')
-
-        # Determine search term
-        search_term = upc if upc and upc.lower() not in ('nan', 'none', '') else title
-
-        avg_price = avg_shipping = roi = volume = product_link = 0.0
-
-        if platform == "walmart":
-            pass
-        else:
-            avg_price, avg_shipping, roi, volume, product_link = get_ebay_avg_price(search_term, cost)
-
-        platform_fee_percentage = EBAY_FEE_PERCENTAGE if platform == "ebay" else WALMART_FEE_PERCENTAGE
-        platform_link_key = 'ebay_link' if platform == "ebay" else 'walmart_link'
-
-        estimated_fee = avg_price * platform_fee_percentage
-        estimated_shipping = avg_shipping if avg_shipping else DEFAULT_SHIPPING_COST
-        profit = avg_price - actual_price - estimated_fee - estimated_shipping
-        margin = (profit / avg_price * 100) if avg_price > 0 else 0
-
-        return {
-            'SKU': sku,
-            'UPC': upc,
-            'Title': title,
-            'Cost': round(cost, 2),
-            'ActualPrice': round(actual_price, 2),
-            'optional_1': optional_1,
-            'optional_2': optional_2,
-            'optional_3': optional_3,
-            'avg_sold_price': round(avg_price, 2),
-            'estimated_fees': round(estimated_fee, 2),
-            'estimated_shipping': round(estimated_shipping, 2),
-            'estimated_profit': round(profit, 2),
-            'profit_margin': round(margin, 2),
-            'roi': round(roi, 2),
-            'monthly_volume': volume,
-            platform_link_key: product_link,
-            'optional_1_name':optional_name_1,
-            'optional_2_name':optional_name_2,
-            'optional_3_name':optional_name_3,
-        }
-
-    except Exception as e:
-        logger.error(f"Error processing item: {traceback.format_exc()}")
-        return {
-            'SKU': item_data.get('SKU', ''),
-            'UPC': item_data.get('UPC', ''),
-            'Title': item_data.get('Title', ''),
-            'Cost': item_data.get('Cost', 0),
-            'ActualPrice': item_data.get('ActualPrice', 0),
-            'optional_1': item_data.get('optional_1', ''),
-            'optional_2': item_data.get('optional_2', ''),
-            'optional_3': item_data.get('optional_3', ''),
-            'error': str(e),
-            'avg_sold_price': 0,
-            'estimated_fees': 0,
-            'estimated_shipping': DEFAULT_SHIPPING_COST,
-            'estimated_profit': 0,
-            'profit_margin': 0,
-            'roi': 0,
-            'monthly_volume': 0,
-            'ebay_link' if platform == "ebay" else 'walmart_link': '#',
-            'optional_1_name':optional_name_1,
-            'optional_2_name':optional_name_2,
-            'optional_3_name':optional_name_3,
-        }
+        while True:
+            try:
+                yield loop.run_until_complete(anext(chunks))
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+def _streamed(request, chunks):
+    """
+    Response content that streams under both ASGI and WSGI.
+
+    Django collects the whole iterator before sending when the protocol does not match
+    its kind (sync under ASGI, async under WSGI), so it is adapted here instead.
+    """
+    if isinstance(request, ASGIRequest):
+        return chunks if hasattr(chunks, '__aiter__') else _in_thread(iter(chunks))
+    return _blocking(chunks) if hasattr(chunks, '__aiter__') else chunks
+
+
+async def _file_names():
+    return [name async for name in RawCsv.objects.order_by('-created_at').values_list('name', flat=True)]
+
+
+def _store_upload(file):
+    """Sniff, keep and preview an uploaded file: (stages, upload) with upload None when it has no header row."""
+    stages = {}
+    with metrics.stage('upload_sniff', summary=stages):
+        encoding, header_row = ingest.sniff(file)
+    if header_row is None:
+        return stages, None
+
+    # The file is kept as uploaded; only the preview rows are parsed now
+    with metrics.stage('upload_store', summary=stages):
+        upload_id = artifacts.save_file(file)
+    with metrics.stage('upload_preview', summary=stages) as parse:
+        preview = ingest.preview(file, encoding, header_row)
+        parse.rows = len(preview['sample'])
+    return stages, {'id': upload_id, 'encoding': encoding, 'header_row': header_row, 'preview': preview}
+
 
 @csrf_exempt
-def analyze(request):
+async def analyze(request):
     if request.method == "GET" and request.GET.get("id"):
-        csv_list = list(RawCsv.objects.order_by('-created_at').values_list('name', flat=True))
-        return JsonResponse({"results": csv_list})
+        return JsonResponse({"results": await _file_names()})
     
     if request.method == "GET" and request.GET.get("delete"):
 
         name = request.GET.get("delete")
-        instance = RawCsv.objects.filter(name=name)
-        if len(instance):
-            instance[0].delete()
+        instance = await RawCsv.objects.filter(name=name).afirst()
+        if instance:
+            await instance.adelete()
 
-        csv_list = list(RawCsv.objects.order_by('-created_at').values_list('name', flat=True))
-        return JsonResponse({"results": csv_list})
+        return JsonResponse({"results": await _file_names()})
     
-    if request.method == 'GET' and not request.GET.get('download'):
+    if request.method == 'GET' and request.GET.get('download'):
+        return await results_export(request, request.GET['download'])
+
+    if request.method == 'GET':
         return render(request, 'home.html')
-    
+
+    if request.method == 'POST':
+        # Parse the (possibly large) multipart body in a thread rather than on the event loop
+        await sync_to_async(lambda: request.FILES)()
+
     if request.method == 'POST' and request.FILES.get('file'):
         try:
             file = request.FILES['file']
 
-            try:
-                content = file.read().decode('utf-8')
-            except UnicodeDecodeError:
-                file.seek(0)
-                content = file.read().decode('latin-1')
-
-            lines = content.splitlines()
-            header_row = None
-            for i, line in enumerate(lines):
-                if 'UPC' in line:
-                    header_row = i
-                    break
-
-            if header_row is None:
+            stages, upload = await sync_to_async(_store_upload)(file)
+            if upload is None:
                 return JsonResponse({'error': "Could not identify header row (UPC missing)", 'success': False}, status=400)
-
-            df = pd.read_csv(io.StringIO('\n'.join(lines[header_row:])))
-            df = df.dropna(how='all')
-
-            for col in df.columns:
-                if df[col].dtype == 'object':
-                    if any(price_indicator in col.lower() for price_indicator in ['retail', 'w/s', 'cost', 'cog']):
-                        df[col] = df[col].astype(str).str.replace('$', '').str.replace(',', '').str.strip()
-                        try:
-                            df[col] = pd.to_numeric(df[col], errors='coerce')
-                        except:
-                            pass
-                    else:
-                        df[col] = df[col].astype(str).str.strip()
-
-            df.columns = df.columns.str.strip().str.lower()
-
-            request.session['raw_csv'] = df.to_json(orient='split')
-            request.session['file_name'] = file.name
-            request.session['cached_results'] = {}
-
-            return JsonResponse({'columns': list(df.columns), 'success': True})
+            preview = upload['preview']
+
+            # The session only carries the artifact id; the file itself lives on disk
+            await sync_to_async(artifacts.delete)(await request.session.aget('upload_id'))
+            await request.session.aupdate({
+                'upload_id': upload['id'],
+                'upload_source': {'encoding': upload['encoding'], 'header_row': upload['header_row'], 'columns': preview['columns']},
+                'file_name': file.name,
+                # Carried over into the summary of the job this upload ends up in
+                'upload_stages': stages,
+            })
+
+            return JsonResponse({**preview, 'success': True})
         except Exception as e:
             logger.error(f"File upload error: {traceback.format_exc()}")
             return JsonResponse({'error': f"Error processing file: {str(e)}", 'success': False}, status=400)
@@ -247,82 +151,52 @@ def analyze(request):
                 'optional_3': request.POST.get('optional_3', '').lower().strip(),
             }
             platform = request.POST.get("platform", "ebay").lower().strip()
+            # Active listings or sold items; the configured default when not chosen
+            market_source = request.POST.get("market_source", "").lower().strip() or None
+            if market_source and market_source not in market_data.PROVIDERS:
+                return JsonResponse({'error': f"Unknown market data source: {market_source}", 'success': False}, status=400)
             discount_percentage = float(selected_fields.get('dis_col') or 0)
-
-            raw_data = request.session.get('raw_csv')
-            if not raw_data:
+            # At most this many eBay calls, spent on the most promising rows first
+            api_budget = request.POST.get("api_budget", "").strip() or None
+            if api_budget is not None:
+                if not api_budget.isdigit():
+                    return JsonResponse({'error': "The API call budget must be a whole number.", 'success': False}, status=400)
+                api_budget = int(api_budget)
+
+            upload_id = await request.session.aget('upload_id')
+            source = await request.session.aget('upload_source')
+            if not upload_id or not source or not artifacts.exists(upload_id):
                 return JsonResponse({'error': "Session expired. Please upload your file again.", 'success': False}, status=400)
 
-            df = pd.read_json(raw_data, orient='split')
-
-            # UPC is required
-            df['UPC'] = df[selected_fields['upc_col']]
+            # Checked against the preview now, since the file itself is only parsed by the job
+            if not selected_fields['upc_col']:
+                return JsonResponse({'error': "Please map the UPC column.", 'success': False}, status=400)
+            missing = [col for col in ingest.mapped_columns(selected_fields) if col not in source['columns']]
+            if missing:
+                return JsonResponse({'error': f"Unknown column(s): {', '.join(missing)}", 'success': False}, status=400)
 
-           
-            if selected_fields['sku_col']:
-                df['SKU'] = df[selected_fields['sku_col']]
-
-            if selected_fields['title_col']:
-                df['Title'] = df[selected_fields['title_col']]
-
-            if selected_fields['cost_col']:
-                df['Cost'] = pd.to_numeric(df[selected_fields['cost_col']].replace('[\$,]', '', regex=True), errors='coerce').fillna(0)
-            else:
-                df['Cost'] = 0
-
-            df['ActualPrice'] = df['Cost'] * (1 - discount_percentage / 100)
-
-           
-            optional_keys = ['optional_1', 'optional_2', 'optional_3']
             col_names = {
-                "optional_name_1":"",
-                "optional_name_2":"",
-                "optional_name_3":"",
+                "optional_name_1": selected_fields['optional_1'],
+                "optional_name_2": selected_fields['optional_2'],
+                "optional_name_3": selected_fields['optional_3'],
             }
-         
-            for idx, opt in enumerate(optional_keys):
-                col_name = selected_fields.get(opt)
-
-                if col_name:
-                    col_names[f"optional_name_{idx + 1}"] = col_name
-                    df[col_name] = df[col_name]
-            
-
-            cached_results = request.session.get('cached_results', {})
-            new_cache = {}
-            items = df.to_dict(orient='records')
-        
-            results = []
-
-            def worker(item):
-                item_hash = hash_item(item)
-                if item_hash in cached_results:
-                    return cached_results[item_hash]
-                else:
-                    result = process_item(item, platform,col_names=col_names)
-                    new_cache[item_hash] = result
-                    return result
-
-            with ThreadPoolExecutor(max_workers=15) as executor:
-                results = list(executor.map(worker, items))
-
-            cached_results.update(new_cache)
-            request.session['cached_results'] = cached_results
-            request.session['analysis_results'] = results
-
-            results.sort(key=lambda x: x.get('profit_margin', 0), reverse=True)
-
-            instance = RawCsv.objects.filter(name=request.session.get('file_name')).last()
+            mapping = {
+                'encoding': source['encoding'],
+                'header_row': source['header_row'],
+                'fields': selected_fields,
+                'discount_percentage': discount_percentage,
+            }
+            stages = dict(await request.session.aget('upload_stages') or {})
+
+            file_name = await request.session.aget('file_name')
+            instance = await RawCsv.objects.filter(name=file_name).alast()
             if not instance:
-                instance = RawCsv(name=request.session.get('file_name'))
-            if platform == 'ebay':
-                instance.EbayData = json.dumps(results)
-            else:
-                instance.WalmartData = json.dumps(results)
-            instance.save()
-
-            csv_list = list(RawCsv.objects.order_by('-created_at').values_list('name', flat=True))
-            return JsonResponse({"results": csv_list})
+                instance = await RawCsv.objects.acreate(name=file_name)
+
+            job = await sync_to_async(jobs.create_job)(instance, platform, col_names, upload_id, mapping, stages, market_source, api_budget)
+            jobs.submit(job.id)
+
+            return JsonResponse({"results": await _file_names(), "job": jobs.progress(job)})
         except Exception as e:
             logger.error(f"Analysis error: {traceback.format_exc()}")
             return JsonResponse({'error': f"Analysis error: {str(e)}", 'success': False}, status=400)
@@ -332,59 +206,145 @@ def analyze(request):
 
 
 
-@csrf_exempt
-def getData(request):
-    if request.method == "POST" and request.GET.get("name"):
-        name = request.GET.get("name")
-        platform = request.GET.get("platform")
-        instance = RawCsv.objects.filter(name=name).last()
-
-        if platform == "Walmart":
-            platform_data = instance.WalmartData if instance else None
-        elif platform == "Ebay":
-            platform_data = instance.EbayData if instance else None
-        else:
-            platform_data = None
-
-        if platform_data:
-            try:
-                if isinstance(platform_data, str):
-                    platform_data = platform_data.replace("'", '"')  # Normalize JSON quotes
-
-                data = json.loads(platform_data) if isinstance(platform_data, str) else platform_data
-
-                if isinstance(data, list):
-                    for item in data:
-                        # Ensure optional fields are always present
-                        item.setdefault("optional_1", "")
-                        item.setdefault("optional_2", "")
-                        item.setdefault("optional_3", "")
-
-                        # Clean up empty values
-                        for key in list(item.keys()):
-                            if item[key] == '' or item[key] == '""':
-                                if key in ['Cost', 'ActualPrice', 'avg_sold_price', 'estimated_fees',
-                                           'estimated_shipping', 'estimated_profit', 'profit_margin',
-                                           'roi', 'monthly_volume']:
-                                    item[key] = 0
-                                else:
-                                    item[key] = ""
-
-                return JsonResponse({"results": data})
-            except json.JSONDecodeError:
-                return JsonResponse({"error": f"Invalid JSON format in {platform} data"}, status=400)
-        else:
+async def _analysis_for(request, platform):
+    # One query: the file plus when its results for this platform were last written
+    return await RawCsv.objects.filter(name=request.GET.get("name")).annotate(
+        results_written_at=Max('jobs__finished_at', filter=Q(jobs__platform=platform, jobs__status='done'))
+    ).alast()
+
+
+@gzip_page
+async def results_data(request):
+    platform = (request.GET.get("platform") or "").lower()
+    instance = await _analysis_for(request, platform) if platform in ("ebay", "walmart") else None
+    if not instance:
+        metrics.inc('csvanalyzer_results_requests_total', outcome='not_found')
+        return JsonResponse({"error": "Data not found for the provided name and platform."}, status=404)
+
+    # Results only change when a job finishes; repeat loads revalidate without touching them
+    written_at = instance.results_written_at or instance.created_at
+    etag = results.etag(instance, platform, written_at, request.GET)
+    last_modified = int(written_at.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        if not await instance.results.filter(platform=platform).aexists():
+            metrics.inc('csvanalyzer_results_requests_total', outcome='not_found')
             return JsonResponse({"error": "Data not found for the provided name and platform."}, status=404)
+        with metrics.stage('get_data'):
+            meta, rows = await sync_to_async(results.page)(instance, platform, request.GET)
+        response = StreamingHttpResponse(_streamed(request, results.stream(meta, rows)), content_type='application/json')
+        metrics.inc('csvanalyzer_results_requests_total', outcome='ok')
+    else:
+        metrics.inc('csvanalyzer_results_requests_total', outcome='not_modified')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+async def results_export(request, file_format=None):
+    """The whole filtered, sorted analysis as a CSV or XLSX download, streamed from the database."""
+    file_format = (file_format or request.GET.get('format') or 'csv').lower()
+    if file_format not in export.FORMATS:
+        return JsonResponse({"error": f"Unsupported export format: {file_format}"}, status=400)
+    platform = (request.GET.get("platform") or "").lower()
+    instance = await _analysis_for(request, platform) if platform in ("ebay", "walmart") else None
+    first = await instance.results.filter(platform=platform).order_by(*results.DEFAULT_ORDERING).afirst() if instance else None
+    if first is None:
+        return JsonResponse({"error": "Data not found for the provided name and platform."}, status=404)
+
+    titles = export.header(platform, first)
+    rows = export.export_rows(instance, platform, request.GET)
+    stream = export.stream_xlsx if file_format == 'xlsx' else export.stream_csv
+    response = StreamingHttpResponse(_streamed(request, stream(titles, rows)), content_type=export.FORMATS[file_format])
+    stem = instance.name.rsplit('.', 1)[0]
+    response['Content-Disposition'] = content_disposition_header(True, f'{stem}_{platform}_analysis.{file_format}')
+    metrics.inc('csvanalyzer_exports_total', format=file_format)
+    return response
+
 
-    if request.method == "GET":
-        name = request.GET.get("name")
-        instance = RawCsv.objects.filter(name=name).last()
+@csrf_exempt
+async def getData(request):
+    if request.method == "POST" and request.GET.get("name"):
+        return await results_data(request)
 
+    # The page loads its rows itself, from analyze/data
     return render(request, 'analyze.html')
 
 
 
-# alanswim@aol.com
+async def job_status(request, job_id):
+    job = await AnalysisJob.objects.select_related('raw_csv').filter(id=job_id).afirst()
+    if not job:
+        return JsonResponse({"error": "Job not found."}, status=404)
+
+    # The worker that owned this job died; pick it up again from its last checkpoint
+    if jobs.is_stale(job):
+        jobs.submit(job.id)
 
+    return JsonResponse(jobs.progress(job))
 
 
+async def job_stream(request, job_id):
+    """
+    A job's progress and result rows as Server-Sent Events, from the first checkpoint on.
+
+    Under ASGI an open stream is a coroutine waiting between polls, not a worker thread.
+    """
+    job = await AnalysisJob.objects.select_related('raw_csv').filter(id=job_id).afirst()
+    if not job:
+        return JsonResponse({"error": "Job not found."}, status=404)
+    try:
+        start = max(0, int(request.headers.get('Last-Event-ID') or request.GET.get('from') or 0))
+    except ValueError:
+        start = 0
+
+    response = StreamingHttpResponse(_streamed(request, job_events.stream(job, start)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Tells nginx not to buffer the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def price_history_data(request):
+    """
+    Price history of the UPCs or titles given as `term` (repeatable, up to a results page's worth):
+    the `limit` newest snapshots of each and its 7/30-day averages, from one query per batch of terms.
+    """
+    terms = list(dict.fromkeys(t.strip() for t in request.GET.getlist('term') if t.strip()))
+    if not terms:
+        return JsonResponse({"error": "Give at least one term."}, status=400)
+    if len(terms) > results.RESULTS_MAX_PAGE_SIZE:
+        return JsonResponse({"error": f"At most {results.RESULTS_MAX_PAGE_SIZE} terms per request."}, status=400)
+    try:
+        source = market_data.get_provider(request.GET.get('source')).name
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit') or 10), 1), 100)
+    except ValueError:
+        limit = 10
+
+    snapshots = await sync_to_async(price_history.last_snapshots)(terms, source, limit)
+    trends = await sync_to_async(price_history.trends)(terms, source)
+    return JsonResponse({
+        "source": source,
+        "history": {term: {**trends[term], "snapshots": snapshots[term]} for term in terms},
+    })
+
+
+def prometheus_metrics(request):
+    # Counters and histograms are per process; job counts come from the database
+    extra = [('csvanalyzer_market_cache_total', {'event': event}, n) for event, n in market_cache.stats().items()]
+    extra.append(('csvanalyzer_lookups_in_flight', {}, single_flight.in_flight()))
+    for status, n in AnalysisJob.objects.values_list('status').annotate(n=Count('id')).order_by():
+        extra.append(('csvanalyzer_jobs', {'status': status}, n))
+    today = timezone.localdate()
+    for key_id, calls, usage_date, limit in Key.objects.filter(Approved=True).values_list('id', 'calls_today', 'usage_date', 'daily_limit'):
+        extra.append(('csvanalyzer_ebay_key_calls_today', {'key': key_id}, calls if usage_date == today else 0))
+        extra.append(('csvanalyzer_ebay_key_daily_limit', {'key': key_id}, limit))
+    return HttpResponse(metrics.render(extra), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+
+# alanswim@aol.com
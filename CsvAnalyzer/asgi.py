@@ -1,7 +1,9 @@
 """
 ASGI config for CsvAnalyzer project.
 
-It exposes the ASGI callable as a module-level variable named ``application``.
+It exposes the ASGI callable as a module-level variable named ``application``. Serve it with e.g.
+``uvicorn CsvAnalyzer.asgi:application``; the views are async, so an open
+job event stream waits on the event loop instead of holding a worker thread.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
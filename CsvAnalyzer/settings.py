@@ -79,6 +79,12 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Analysis worker threads write concurrently; wait for the lock instead of failing.
+        # WAL mode is switched on once per database file by migration Core.0013_sqlite_wal.
+        "OPTIONS": {
+            "timeout": 20,
+            "transaction_mode": "IMMEDIATE",
+        },
     }
 }
 
@@ -124,3 +130,74 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# eBay market data cache
+# Lookups are shared across sessions and uploads, keyed by the normalized search term.
+
+MARKET_CACHE_TTL = 60 * 60 * 24  # seconds
+MARKET_CACHE_MAX_ENTRIES = 200000
+MARKET_CACHE_CULL_FREQUENCY = 3  # evict 1/N of the entries when full
+MARKET_CACHE_CULL_EVERY = 500  # stores between checks of the size limit
+
+
+# eBay OAuth token, shared by all worker processes on this host
+
+EBAY_TOKEN_STORE = os.path.join(BASE_DIR, 'var', 'ebay_token.json')
+EBAY_TOKEN_REFRESH_MARGIN = 300  # refresh this many seconds before expiry
+
+
+# Outbound eBay HTTP client
+
+EBAY_MAX_WORKERS = 15  # concurrent lookups per analysis, also the connection pool size
+EBAY_CONNECT_TIMEOUT = 5  # seconds
+EBAY_READ_TIMEOUT = 20  # seconds
+EBAY_RATE_LIMIT = 25  # Browse API calls per second per approved key, shared by every analysis in the process
+EBAY_RATE_BURST = 50
+EBAY_PROCESS_RATE_LIMIT = 250  # ceiling for the whole process, however many keys are approved
+EBAY_PROCESS_RATE_BURST = 500
+EBAY_KEY_THROTTLE_COOLDOWN = 60  # seconds a throttled key rests when eBay sends no Retry-After
+EBAY_KEY_POOL_REFRESH = 60  # seconds between reloads of the approved keys
+EBAY_KEY_USAGE_FLUSH = 25  # calls per key between writes of its usage counter
+EBAY_RETRY_ATTEMPTS = 4  # tries per lookup on timeouts, 429s and 5xx
+EBAY_RETRY_BASE_DELAY = 0.5  # seconds; backoff doubles per attempt, with full jitter
+EBAY_RETRY_MAX_DELAY = 30
+EBAY_BREAKER_THRESHOLD = 10  # consecutive failures before every lookup pauses
+EBAY_BREAKER_COOLDOWN = 30  # seconds
+EBAY_WORKER_CLOSE_TIMEOUT = 30  # seconds to wait while closing fetch worker threads' DB connections
+# EBAY_OAUTH_URL / EBAY_SEARCH_URL / EBAY_SOLD_SEARCH_URL can be pointed at a local stub server for testing
+MARKET_DATA_SOURCE = 'active'  # default pricing source: 'active' listings or 'sold' items (Marketplace Insights)
+
+
+# Background analysis jobs
+
+ANALYSIS_JOB_WORKERS = 2  # jobs running at once per process
+ANALYSIS_JOB_CHUNK_SIZE = 200  # rows per checkpoint
+ANALYSIS_JOB_FIRST_CHUNK_SIZE = 25  # rows in a job's first checkpoint; chunks double from here up to the size above
+ANALYSIS_JOB_STALE_AFTER = 120  # seconds without a heartbeat before a running job is resumed
+ANALYSIS_JOB_HEARTBEAT = 15  # seconds between heartbeats of a running job, whatever stage it is in
+ANALYSIS_RESULT_BATCH_SIZE = 500  # result rows per INSERT
+ANALYSIS_STREAM_POLL = 0.25  # seconds between checks for new rows in a job's event stream
+ANALYSIS_STREAM_KEEPALIVE = 15  # seconds of silence before the event stream sends a keepalive comment
+ANALYSIS_STREAM_BATCH_ROWS = 500  # saved rows per event once a streamed job is done
+ANALYSIS_STREAM_CACHE_PARTS = 256  # encoded checkpoint parts kept in memory for the event streams of running jobs
+BUDGET_QUERY_BATCH = 500  # UPCs per query when ranking rows for a job with an API call budget
+PRICE_HISTORY_RETENTION_DAYS = 180  # days of market price snapshots kept for the trend columns
+PRICE_HISTORY_QUERY_BATCH = 500  # search terms per price history query
+RESULTS_PAGE_SIZE = 50  # rows per page on the analyze page
+RESULTS_MAX_PAGE_SIZE = 500
+EXPORT_CHUNK_ROWS = 2000  # rows read from the database and sent per chunk of an export
+
+
+# Upload ingestion: files are stored as uploaded and parsed once, in bounded chunks, by the analysis job
+
+UPLOAD_SNIFF_BYTES = 256 * 1024  # bytes read up front to detect encoding and header row
+UPLOAD_CHUNK_ROWS = 20000  # rows per chunk when the analysis job parses the file
+UPLOAD_PREVIEW_ROWS = 20  # rows parsed at upload time for the column mapping preview
+
+
+# Artifact store for parsed uploads and job data (Parquet parts on local disk)
+
+ARTIFACT_DIR = os.path.join(BASE_DIR, 'var', 'artifacts')
+ARTIFACT_TTL = 60 * 60 * 24 * 2  # seconds since last write before an artifact is evicted
+ARTIFACT_EVICT_INTERVAL = 60 * 60  # seconds between eviction sweeps